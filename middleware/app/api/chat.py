@@ -1,124 +1,45 @@
 from fastapi import APIRouter
-from app.models.chat import ChatRequest, ChatResponse
-from app.services import redis_service, neo4j_service, semantic
-from rank_bm25 import BM25Okapi
-import numpy as np
-import logging
-
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+from fastapi.responses import StreamingResponse
+from app.models.chat import BatchDiagnoseRequest, ChatRequest, ChatResponse
+from app.services import redis_service, diagnosis, idempotency, log_setup, metrics
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 @router.post("/diagnose", response_model=ChatResponse)
+@metrics.timed("total")
 def chat_endpoint(req: ChatRequest):
-    uid, sid = req.user_id, req.session_id
-    state = redis_service.get_session(uid, sid) or {}
-    turn = redis_service.incr_turn(uid, sid)  # 先自增轮次
-
-    logger.info(f"Step 1: User ID: {uid}, Session ID: {sid}, Turn: {turn}, Intent: {req.intent}, Query: {req.query}, Entities: {req.entities}")
-
-    # 1. 把 Dify 给的实体做一次标准化 / 相似度校验
-    confirmed = []
-    pending = None
-    for ent in req.entities or []:
-        norm = semantic.normalize_symptom(ent)
-        if norm:
-            confirmed.append(norm)
-        else:
-            pending = ent  # 需要澄清
+    # Dify 重试的重复请求直接返回缓存的响应或等待进行中的同一请求，不会重复编码、打分和自增轮次
+    return idempotency.run(req, _diagnose)
 
-    logger.info(f"Step 2: Normalized entities: {confirmed}, Pending clarification: {pending}")
+def _diagnose(req: ChatRequest) -> ChatResponse:
+    uid, sid = req.user_id, req.session_id
+    # 1. 把 Dify 给的实体做一次标准化 / 相似度校验（整轮实体批量编码）
+    confirmed, pending, retracted = diagnosis.split_entities(req.entities or [], req.retracted_entities or [])
 
-    # 2. 更新 Redis 状态
-    existing_entities = set(state.get("entities", []))
+    # 2. 一次往返：自增轮次、原子合并本轮症状到会话症状集合（并移除撤回的症状）并读取会话
     new_entities = [entity[0] for entity in confirmed]  # 提取 symptom 部分
-    updated_entities = list(existing_entities.union(new_entities))  # 合并并去重
-    redis_service.set_session(
-        uid, sid,
-        intent=req.intent,
-        query=req.query,  # 记录用户的原始查询
-        entities=updated_entities,
-        pending=pending,
-    )
-
-    # 3. 如果需要澄清
-    if pending:
-        question = f"您提到的“{pending}”暂未识别，请确认具体症状？"
-        redis_service.set_session(uid, sid, last_question=question)
-        logger.info(f"Step 3: Clarification needed for: {pending}")
-        return ChatResponse(
-            reply=question,
-            session_state=redis_service.get_session(uid, sid),
-            need_clarify=True,
-            diagnosed=False,
-            diseases=None,
-            symptoms=updated_entities  # 确保返回的 symptoms 是最新的
-        )
-
-    # 4. 无需澄清，则用已确认实体查询 Redis
-    user_symptoms = state.get("entities", [])
-    all_disease_symptoms = redis_service.get_all_disease_symptoms()
-
-    logger.info(f"Step 4: User symptoms: {user_symptoms}")
-    logger.info(f"Step 4: Loaded disease symptoms: {all_disease_symptoms}")
-
-    # 5. 计算相似度
-    disease_ids = list(all_disease_symptoms.keys())
-    disease_symptoms = [disease["symptoms"] for disease in all_disease_symptoms.values()]
-    bm25 = BM25Okapi(disease_symptoms)
-    similarity_scores = bm25.get_scores(user_symptoms)
-    threshold = 0.7  # 相似度阈值
-    diagnosed_diseases = [all_disease_symptoms[disease_id] for disease_id, score in zip(disease_ids, similarity_scores) if score >= threshold]
-
-    logger.info(f"Step 5: Similarity scores: {similarity_scores}")
-    logger.info(f"Step 5: Diagnosed diseases: {[disease['disease_name'] for disease in diagnosed_diseases]}")
-
-    # 6. 如果确诊疾病，返回疾病和症状列表
-    if diagnosed_diseases:
-        diagnosed_disease_names = [disease["disease_name"] for disease in diagnosed_diseases]
-        diagnosed_symptoms = [symptom for disease in diagnosed_diseases for symptom in disease["symptoms"]]
-        reply = f"根据症状 {', '.join(user_symptoms)}，确诊的疾病有：{', '.join(diagnosed_disease_names)}"
-        redis_service.set_session(uid, sid, diagnosed=True, diseases=diagnosed_disease_names)
-        logger.info(f"Step 6: Diagnosis reply: {reply}")
-        return ChatResponse(
-            reply=reply,
-            session_state=redis_service.get_session(uid, sid),
-            need_clarify=False,
-            diagnosed=True,
-            diseases=diagnosed_disease_names,
-            symptoms=updated_entities  # 确保返回的 symptoms 是最新的
-        )
-
-    # 7. 如果未确诊，继续澄清症状
-    suggested_symptoms = neo4j_service.get_suggested_symptoms(disease_ids, state.get("entities", []))
-    question = f"根据症状您的症状描述，家禽可能患有的疾病有多个。请提供更多症状以缩小范围。建议描述以下症状：{', '.join(suggested_symptoms)}"
-    redis_service.set_session(uid, sid, last_question=question)
-    logger.info(f"Step 7: Suggested symptoms: {suggested_symptoms}")
-    return ChatResponse(
-        reply=question,
-        session_state=redis_service.get_session(uid, sid),
-        need_clarify=True,
-        diagnosed=False,
-        diseases=None,
-        symptoms=updated_entities  # 确保返回的 symptoms 是最新的
-    )
-
-    # 8. 如果未确诊且轮数 >= 20，结束对话并给出最可能的三个疾病
-    if turn >= 20:
-        logger.info(f"Step 8: Reaching max turns, ending the conversation.")
-        top_diseases = sorted(zip(disease_ids, similarity_scores), key=lambda x: x[1], reverse=True)[:3]
-        top_disease_names = [all_disease_symptoms[disease_id]["disease_name"] for disease_id, _ in top_diseases]
-        reply = f"经过以上您提供的症状，经过分析，家禽最可能患有的疾病是：{', '.join(top_disease_names)}"
-        redis_service.set_session(uid, sid, diagnosed=False, diseases=top_disease_names)
-        logger.info(f"Step 7: Final reply: {reply}")
-        return ChatResponse(
-            reply=reply,
-            session_state=redis_service.get_session(uid, sid),
-            need_clarify=False,
-            diagnosed=False,
-            diseases=top_disease_names,
-            symptoms=updated_entities  # 确保返回的 symptoms 是最新的
-        )
-        
\ No newline at end of file
+    state, turn, added, removed = redis_service.begin_turn(uid, sid, new_entities, retracted)
+    # 之后本请求的日志都带上 user_id / session_id / turn
+    log_setup.bind(uid, sid, turn)
+
+    # 3~8. 澄清 / 打分 / 确诊 / 追问（与异步接口共用，见 diagnosis.plan_turn），本轮字段一次性写回 Redis
+    plan = diagnosis.plan_turn(req, state, turn, added, removed, confirmed, pending, retracted)
+    session_state = redis_service.commit_turn(uid, sid, state, finished=plan["finished"], **plan["fields"])
+    return diagnosis.turn_response(req, plan, session_state)
+
+@router.post("/diagnose/batch")
+def batch_endpoint(req: BatchDiagnoseRequest):
+    """
+    批量诊断（分析 / 分诊工具对历史报告打分）：逐块批量编码、一次矩阵乘法打分，
+    以 NDJSON 按输入顺序流式返回，每个症状集合一行，不落会话。
+    """
+    chunks = diagnosis.batch_chunks([item.entities for item in req.items], req.top_k)
+
+    def lines():
+        position = 0
+        for results in chunks:  # StreamingResponse 在线程池中迭代同步生成器，不阻塞事件循环
+            yield "".join(diagnosis.batch_line(position + j, req.items[position + j].id, result)
+                          for j, result in enumerate(results))
+            position += len(results)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,57 @@
+# 诊断接口的异步实现（DIAGNOSE_MODE=async）：Redis / Neo4j 走异步客户端，
+# 编码与打分等 CPU 密集步骤放到有界线程池，不占用事件循环和默认线程池
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from app.config import settings
+from app.models.chat import BatchDiagnoseRequest, ChatRequest, ChatResponse
+from app.services import redis_async, diagnosis, idempotency, log_setup, metrics
+
+router = APIRouter(prefix="/api/chat", tags=["chat"])
+
+_executor = ThreadPoolExecutor(max_workers=settings.cpu_workers, thread_name_prefix="diagnose-cpu")
+
+async def _run_cpu(func, *args):
+    # 带上当前请求的上下文（后端调用计数等），run_in_executor 默认不会传递 contextvars
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+@router.post("/diagnose", response_model=ChatResponse)
+@metrics.timed("total")
+async def chat_endpoint(req: ChatRequest):
+    # Dify 重试的重复请求直接返回缓存的响应或等待进行中的同一请求，不会重复编码、打分和自增轮次
+    return await idempotency.run_async(req, _diagnose)
+
+async def _diagnose(req: ChatRequest) -> ChatResponse:
+    uid, sid = req.user_id, req.session_id
+    # 1. 实体标准化：缓存走异步 Redis，只有未命中的编码与检索进入 CPU 线程池
+    confirmed, pending, retracted = await diagnosis.split_entities_async(
+        req.entities or [], req.retracted_entities or [], _run_cpu)
+
+    # 2. 一次往返：自增轮次、原子合并本轮症状到会话症状集合（并移除撤回的症状）并读取会话
+    new_entities = [entity[0] for entity in confirmed]  # 提取 symptom 部分
+    state, turn, added, removed = await redis_async.begin_turn(uid, sid, new_entities, retracted)
+    # 之后本请求的日志都带上 user_id / session_id / turn（_run_cpu 会把上下文带进线程池）
+    log_setup.bind(uid, sid, turn)
+
+    # 3~8. 澄清 / 打分 / 确诊 / 追问整体在 CPU 线程池中执行，不访问 Redis
+    plan = await _run_cpu(diagnosis.plan_turn, req, state, turn, added, removed, confirmed, pending, retracted)
+    session_state = await redis_async.commit_turn(uid, sid, state, finished=plan["finished"], **plan["fields"])
+    return diagnosis.turn_response(req, plan, session_state)
+
+@router.post("/diagnose/batch")
+async def batch_endpoint(req: BatchDiagnoseRequest):
+    """批量诊断：每块的编码与打分在 CPU 线程池中执行，以 NDJSON 按输入顺序流式返回"""
+    chunks = diagnosis.batch_chunks([item.entities for item in req.items], req.top_k)
+
+    async def lines():
+        position = 0
+        while (results := await _run_cpu(next, chunks, None)) is not None:
+            yield "".join(diagnosis.batch_line(position + j, req.items[position + j].id, result)
+                          for j, result in enumerate(results))
+            position += len(results)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -6,5 +6,36 @@ class Settings(BaseSettings):
     neo4j_user: str = Field(..., env="NEO4J_USER")
     neo4j_password: str = Field(..., env="NEO4J_PASSWORD")
     redis_url: str = Field(..., env="REDIS_URL")
+    graph_source: str = Field("neo4j", env="GRAPH_SOURCE")  # neo4j / csv（本地替身：直接读取知识图谱导入 CSV）
+    graph_csv_dir: str = Field("", env="GRAPH_CSV_DIR")  # GRAPH_SOURCE=csv 时的 CSV 目录，默认 pre-process/KG/import_data
+    backend_call_stats: bool = Field(False, env="BACKEND_CALL_STATS")  # 响应头 X-Backend-Calls 返回本次请求的 Redis / Neo4j 往返次数
+    log_file: str = Field("/home/poultrygpt/middleware/logs/app.log", env="LOG_FILE")  # JSON lines 日志文件（每天轮转），为空时输出到 stderr
+    log_level: str = Field("INFO", env="LOG_LEVEL")
+    log_sample_rate: float = Field(0.0, env="LOG_SAMPLE_RATE")  # 输出逐请求调试转储（各疾病得分等）的请求比例
+    log_queue_size: int = Field(10000, env="LOG_QUEUE_SIZE")  # 日志队列上限，写盘跟不上时丢弃而不阻塞请求
+    session_ttl: int = Field(7 * 24 * 3600, env="SESSION_TTL")  # 会话滑动过期时间（秒），每轮刷新，0 为不过期
+    session_finished_ttl: int = Field(3600, env="SESSION_FINISHED_TTL")  # 确诊 / 达到最大轮数后会话的保留时间（秒）
+    session_archive_file: str = Field("/home/poultrygpt/middleware/logs/sessions.jsonl", env="SESSION_ARCHIVE_FILE")  # 已结束会话的归档文件，为空时不归档
+    idempotency_ttl: int = Field(30, env="IDEMPOTENCY_TTL")  # 重复请求（Dify 重试）返回缓存响应的时间窗口（秒），0 为关闭
+    idempotency_wait: float = Field(10.0, env="IDEMPOTENCY_WAIT")  # 等待进行中的同一请求的最长时间（秒），超时返回 503 由上游重试
+    idempotency_pending_ttl: float = Field(120.0, env="IDEMPOTENCY_PENDING_TTL")  # 计算中占位的保留时间（秒），应不短于上游请求超时
+    metrics_enabled: bool = Field(False, env="METRICS_ENABLED")  # 记录各阶段耗时等 Prometheus 指标并在 /metrics 导出
+    startup_retries: int = Field(5, env="STARTUP_RETRIES")  # 启动阶段失败后的重试次数（指数退避，1s 起、最长 30s）
+    preload_lock_ttl: int = Field(120, env="PRELOAD_LOCK_TTL")  # 预加载锁超时（秒）
+    preload_stamp_ttl: int = Field(3600, env="PRELOAD_STAMP_TTL")  # 图谱戳有效期（秒），过期后重启会重新预加载
+    diagnose_mode: str = Field("sync", env="DIAGNOSE_MODE")  # sync / async 诊断接口实现
+    cpu_workers: int = Field(4, env="CPU_WORKERS")  # async 模式下编码与打分的线程池大小
+    vector_index_backend: str = Field("exact", env="VECTOR_INDEX_BACKEND")  # exact / hnsw
+    norm_cache_size: int = Field(10000, env="NORM_CACHE_SIZE")  # 进程内症状标准化 LRU 容量
+    norm_cache_ttl: int = Field(7 * 24 * 3600, env="NORM_CACHE_TTL")  # Redis 共享缓存过期时间（秒）
+    encoder_backend: str = Field("torch", env="ENCODER_BACKEND")  # torch / onnx 编码模型推理后端
+    onnx_model_dir: str = Field("", env="ONNX_MODEL_DIR")  # ONNX 模型目录，默认 app/services/onnx_model
+    onnx_quantized: bool = Field(True, env="ONNX_QUANTIZED")  # 使用 int8 动态量化模型
+    onnx_threads: int = Field(0, env="ONNX_THREADS")  # onnxruntime 线程数，0 为自动
+    encoder_mode: str = Field("local", env="ENCODER_MODE")  # local（每个 worker 自带模型）/ sidecar（共享编码服务）
+    embed_socket: str = Field("/tmp/poultry-embed.sock", env="EMBED_SOCKET")  # 编码服务的 Unix socket 路径
+    embed_timeout: float = Field(5.0, env="EMBED_TIMEOUT")  # 单次编码请求超时（秒）
+    embed_batch_window_ms: float = Field(3.0, env="EMBED_BATCH_WINDOW_MS")  # 编码服务攒批窗口（毫秒）
+    embed_batch_max: int = Field(64, env="EMBED_BATCH_MAX")  # 编码服务单批最多文本数
     
 settings = Settings()
\ No newline at end of file
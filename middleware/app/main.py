@@ -1,48 +1,76 @@
-from fastapi import FastAPI
-from app.api.chat import router as chat_router
-from app.services.semantic import KB_IDS, KB_NAMES, KB_VECS  # 触发加载
-from app.services.neo4j_service import preload_diseases_with_symptoms
-import logging
-from logging.handlers import TimedRotatingFileHandler
-import os
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from app.config import settings
+from app.services.semantic import cache_stats
+from app.services import call_stats, disease_snapshot, idempotency, log_setup, metrics, startup
 
+# JSON lines 日志经队列由后台线程写入文件，请求线程不做磁盘 I/O
+log_setup.setup()
 
-# 确保日志文件夹存在
-os.makedirs('/home/poultrygpt/middleware/logs', exist_ok=True)
-
-# 配置日志
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# 创建一个 TimedRotatingFileHandler，每天生成一个新的日志文件
-log_handler = TimedRotatingFileHandler(
-    '/home/poultrygpt/middleware/logs/app.log',  # 日志文件路径
-    when='midnight',  # 每天午夜轮转
-    interval=1,  # 每天轮转一次
-    backupCount=7,  # 保留7天的日志文件
-    encoding='utf-8'
-)
-log_handler.suffix = "%Y-%m-%d"  # 文件名后缀格式
-log_handler.setLevel(logging.INFO)
+app = FastAPI(title="Poultry-Diagnose")
 
-# 设置日志格式
-log_format = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-log_handler.setFormatter(log_format)
+# 压测时按请求统计 Redis / Neo4j 往返次数，通过响应头返回
+if settings.backend_call_stats:
+    call_stats.install()
 
-# 添加日志处理器
-logger.addHandler(log_handler)
+    @app.middleware("http")
+    async def backend_call_stats(request: Request, call_next):
+        token = call_stats.start()
+        try:
+            response = await call_next(request)
+        finally:
+            counts = call_stats.finish(token)
+        response.headers["X-Backend-Calls"] = call_stats.header(counts)
+        return response
 
+@app.exception_handler(idempotency.RequestInFlight)
+async def request_in_flight(request: Request, exc: idempotency.RequestInFlight):
+    # 重复请求等待超时：可重试的 503，稍后重试时直接拿到缓存的响应
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "1"})
 
-app = FastAPI(title="Poultry-Diagnose")
+_startup_future = None  # 保留后台启动任务的引用，异常由 startup.on_done 记录
 
 @app.on_event("startup")
 async def startup_event():
-    logger.info(f"已加载 {len(KB_IDS)} 条症状向量到内存")
-    preload_diseases_with_symptoms()
-    logger.info("所有疾病症状已加载到Redis中")
+    # 模型、向量存储、疾病快照在后台并发加载，服务立即开始监听；就绪与否由 /ready 报告
+    global _startup_future
+    _startup_future = asyncio.get_running_loop().run_in_executor(None, startup.run)
+    _startup_future.add_done_callback(startup.on_done)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    disease_snapshot.stop_listener()
+    log_setup.stop()
 
 @app.get("/health")
 def health():
+    """存活探针：进程能响应即可；启动阶段重试用尽仍失败时返回 503，让编排系统重启 worker"""
+    if startup.has_failed():
+        status = startup.status()
+        return JSONResponse({"status": "failed", "error": status["error"], "phases": status["phases"]}, status_code=503)
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    """就绪探针：所有启动阶段完成前返回 503，并附带各阶段状态与耗时"""
+    status = startup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/cache/stats")
+def normalize_cache_stats():
+    return cache_stats()
+
+# Prometheus 指标：各阶段耗时、缓存命中、每轮结果与会话轮数（多 worker 时见 metrics.py 中的多进程模式说明）
+if settings.metrics_enabled:
+    @app.get("/metrics")
+    def prometheus_metrics():
+        body, content_type = metrics.export()
+        return Response(body, media_type=content_type)
+
+# 诊断接口实现可通过 DIAGNOSE_MODE 切换（sync / async），便于压测对比
+if settings.diagnose_mode == "async":
+    from app.api.chat_async import router as chat_router
+else:
+    from app.api.chat import router as chat_router
 app.include_router(chat_router)
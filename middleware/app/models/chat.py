@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 
 class ChatRequest(BaseModel):
@@ -7,6 +7,8 @@ class ChatRequest(BaseModel):
     query: str  # 来自 Dify
     intent: Optional[str] = None  # 来自 Dify
     entities: Optional[List[str]] = None  # 来自 Dify
+    retracted_entities: Optional[List[str]] = None  # 用户否认 / 撤回的症状，来自 Dify
+    request_id: Optional[str] = None  # 可选的请求 ID，Dify 重试时保持不变；缺省时按请求内容判断重复
 
 class ChatResponse(BaseModel):
     reply: str
@@ -14,4 +16,12 @@ class ChatResponse(BaseModel):
     need_clarify: bool = False
     diagnosed: Optional[bool] = False  # 是否确诊
     diseases: Optional[List[str]] = None  # 确诊的疾病列表
-    symptoms: Optional[List[str]] = None  # 确诊的疾病相关症状列表
\ No newline at end of file
+    symptoms: Optional[List[str]] = None  # 确诊的疾病相关症状列表
+
+class BatchDiagnoseItem(BaseModel):
+    id: Optional[str] = None  # 调用方的记录 ID（如养殖场报告编号），原样返回
+    entities: List[str]  # 一份报告中的症状描述
+
+class BatchDiagnoseRequest(BaseModel):
+    items: List[BatchDiagnoseItem]
+    top_k: int = Field(3, ge=1, le=50)  # 每条结果返回得分最高的疾病数
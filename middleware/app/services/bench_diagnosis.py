@@ -0,0 +1,260 @@
+"""
+离线诊断基准：由知识图谱导入数据（relation.csv 等）合成多轮问诊会话，进程内驱动同步诊断接口，
+报告 top-1 / top-3 准确率、确诊所需轮数以及各阶段延迟分位数。不需要网络、Redis 或 Neo4j：
+Redis 用 fakeredis（需 pip install fakeredis lupa），疾病知识表直接由 CSV 构建代替 Neo4j 预加载。
+
+用法（在 middleware 目录下）：
+    python -m app.services.bench_diagnosis --per-disease 20
+    python -m app.services.bench_diagnosis --encoder stub --noise 0.2 --paraphrase 0.3 --json result.json
+
+--encoder model 使用真实编码模型（需本地已缓存模型）；stub 用字符 bigram 相似度模拟编码器，
+只用于在没有模型的机器上衡量打分 / 缓存等改动，准确率数字不代表真实模型。
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from pathlib import Path
+import numpy as np
+from app.services.kg_csv import KG_DIR, load_kg
+
+# 口语化改写模板，模拟 Dify 抽取出的非标准实体
+PARAPHRASES = ["有{}", "出现{}", "好像{}", "{}的症状", "有点{}", "{}的情况"]
+
+
+def make_sessions(table: dict, per_disease: int, noise: float, paraphrase: float,
+                  max_features: int = 6, seed: int = 0) -> list[dict]:
+    """
+    为每个疾病合成若干会话：随机抽取该病的部分症状，分散到若干轮中说出，
+    以 noise 的概率混入一个其他疾病的症状，以 paraphrase 的概率把症状改写成口语化说法。
+    """
+    rng = random.Random(seed)
+    all_symptoms = sorted({s for record in table.values() for s in record["symptoms"]})
+    sessions = []
+    for disease_id, record in table.items():
+        symptoms = list(dict.fromkeys(record["symptoms"]))
+        for i in range(per_disease):
+            chosen = rng.sample(symptoms, min(len(symptoms), rng.randint(1, max_features)))
+            if rng.random() < noise:
+                chosen.append(rng.choice([s for s in all_symptoms if s not in symptoms] or all_symptoms))
+            rng.shuffle(chosen)
+            mentions = [rng.choice(PARAPHRASES).format(s) if rng.random() < paraphrase else s for s in chosen]
+            # 首轮说 1~2 个症状，其余留给后续追问时补充
+            first = rng.randint(1, min(2, len(mentions)))
+            sessions.append({
+                "session_id": f"{disease_id}-{i}",
+                "disease_id": disease_id,
+                "disease_name": record["disease_name"],
+                "symptoms": set(symptoms),
+                "opening": mentions[:first],
+                "reserve": mentions[first:],
+                "canonical": dict(zip(mentions, chosen)),
+            })
+    return sessions
+
+
+def _suggested(reply: str) -> list[str]:
+    marker = "建议描述以下症状："
+    return reply.split(marker, 1)[1].split(", ") if marker in reply else []
+
+
+def next_entities(session: dict, reserve: list, reply: str, state: dict) -> list[str]:
+    """
+    模拟用户的下一轮输入：需要澄清时改用标准说法；被追问时确认自己有的症状，
+    并从尚未说出的症状（reserve）中补充一个。返回空列表表示用户已无可补充。
+    """
+    pending = state.get("pending")
+    if pending:
+        return [session["canonical"].get(pending, pending)]
+    entities = [s for s in _suggested(reply) if s in session["symptoms"]]
+    if reserve:
+        entities.append(reserve.pop(0))
+    return entities
+
+
+class StubEncoder:
+    """
+    无模型时的替身编码器：按字符 bigram 的 Jaccard 相似度找到最接近的标准症状，
+    返回与该症状向量夹角余弦约等于相似度的向量，近似真实模型“口语化说法也能对上标准症状”的行为。
+    """
+
+    def __init__(self, store):
+        self.names = store.names
+        self.vecs = np.asarray(store.float_vecs(), dtype=np.float32)
+        self.grams = [self._bigrams(name) for name in self.names]
+
+    @staticmethod
+    def _bigrams(text: str) -> set:
+        return {text[i:i + 2] for i in range(max(len(text) - 1, 1))}
+
+    def encode(self, texts, normalize_embeddings=True, **_):
+        out = []
+        for text in texts:
+            grams = self._bigrams(text)
+            sims = [len(grams & g) / len(grams | g) for g in self.grams]
+            best = int(np.argmax(sims))
+            rng = np.random.default_rng(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16))
+            noise = rng.standard_normal(self.vecs.shape[1]).astype(np.float32)
+            noise -= noise @ self.vecs[best] * self.vecs[best]
+            noise /= np.linalg.norm(noise)
+            sim = 0.5 + 0.5 * sims[best]  # 映射到与真实模型相近的相似度区间
+            out.append(sim * self.vecs[best] + np.sqrt(1 - sim ** 2) * noise)
+        return np.array(out, dtype=np.float32)
+
+
+def _install_backends(encoder: str):
+    """在导入 app 模块前把 Redis 换成 fakeredis，并按需换上替身编码器"""
+    for key, value in (("NEO4J_URI", "bolt://localhost:7687"), ("NEO4J_USER", "neo4j"),
+                       ("NEO4J_PASSWORD", "bench"), ("REDIS_URL", "redis://localhost:6379/0")):
+        os.environ.setdefault(key, value)
+    os.environ["ENCODER_MODE"] = "local"
+    try:
+        import fakeredis
+    except ImportError as e:
+        raise RuntimeError("离线基准需要安装 fakeredis 与 lupa：pip install fakeredis lupa") from e
+    import redis
+    import redis.asyncio
+    server = fakeredis.FakeServer()
+    redis.from_url = lambda url, **kw: fakeredis.FakeRedis(server=server, **kw)
+    redis.asyncio.from_url = lambda url, **kw: fakeredis.FakeAsyncRedis(server=server, **kw)
+
+    from app.services import encoder as encoder_module, semantic
+    if encoder == "stub":
+        encoder_module._model = StubEncoder(semantic.load())
+
+
+def _load_snapshot(table: dict):
+    """代替 Neo4j 预加载：直接把 CSV 构建的知识表写入（fake）Redis，再加载内存快照"""
+    from app.services import disease_snapshot, redis_service
+    redis_service.stage_diseases("disease_symptoms:bench", table, 3600)
+    redis_service.publish_disease_table("disease_symptoms:bench", "bench", "bench", 3600)
+    return disease_snapshot.load()
+
+
+class StageTimer:
+    """把诊断接口用到的各个步骤替换为计时包装，按阶段收集耗时（毫秒）"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, module, name: str, stage: str):
+        func = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[stage].append((time.perf_counter() - t0) * 1000)
+
+        setattr(module, name, timed)
+
+    def record(self, stage: str, ms: float):
+        self.samples[stage].append(ms)
+
+    def percentiles(self) -> dict:
+        return {
+            stage: {f"p{q}": round(float(np.percentile(values, q)), 3) for q in (50, 90, 99)} | {"count": len(values)}
+            for stage, values in self.samples.items()
+        }
+
+
+def run(sessions: list[dict], max_turns: int) -> dict:
+    from app.api import chat
+    from app.models.chat import ChatRequest
+    from app.services import diagnosis, disease_snapshot, redis_service, semantic
+
+    timer = StageTimer()
+    timer.wrap(diagnosis, "split_entities", "normalize")
+    timer.wrap(redis_service, "begin_turn", "begin_turn")
+    timer.wrap(diagnosis, "score", "score")
+    timer.wrap(diagnosis, "suggest_symptoms", "suggest")
+    timer.wrap(redis_service, "commit_turn", "commit_turn")
+
+    top1 = top3 = diagnosed = true_in_diagnosed = 0
+    turns_to_diagnosis, diagnosed_sizes = [], []
+    for session in sessions:
+        reserve = list(session["reserve"])
+        entities = list(session["opening"])
+        for turn in range(1, max_turns + 1):
+            req = ChatRequest(user_id="bench", session_id=session["session_id"], query="", intent="diagnose",
+                              entities=entities)
+            t0 = time.perf_counter()
+            resp = chat.chat_endpoint(req)
+            timer.record("total", (time.perf_counter() - t0) * 1000)
+            if resp.diagnosed:
+                diagnosed += 1
+                turns_to_diagnosis.append(turn)
+                diagnosed_sizes.append(len(resp.diseases or []))
+                true_in_diagnosed += session["disease_name"] in (resp.diseases or [])
+                break
+            if resp.diseases:  # 达到最大轮数
+                break
+            entities = next_entities(session, reserve, resp.reply, resp.session_state)
+            if not entities:
+                break
+
+        # 以会话最终症状集合的排名计算 top-k 准确率
+        symptoms = redis_service.get_session("bench", session["session_id"]).get("entities", [])
+        index = disease_snapshot.current().index
+        scores = index.get_scores(symptoms)
+        rank = [index.disease_ids[i] for i in np.lexsort((np.arange(len(scores)), -scores))]
+        top1 += rank[:1] == [session["disease_id"]]
+        top3 += session["disease_id"] in rank[:3]
+
+    n = len(sessions)
+    return {
+        "sessions": n,
+        "top1_accuracy": round(top1 / n, 4),
+        "top3_accuracy": round(top3 / n, 4),
+        "diagnosed_rate": round(diagnosed / n, 4),
+        "true_disease_in_diagnosis": round(true_in_diagnosed / max(diagnosed, 1), 4),
+        "mean_diseases_per_diagnosis": round(float(np.mean(diagnosed_sizes)), 2) if diagnosed_sizes else None,
+        "turns_to_diagnosis": {
+            "mean": round(float(np.mean(turns_to_diagnosis)), 2),
+            "p50": float(np.percentile(turns_to_diagnosis, 50)),
+            "p90": float(np.percentile(turns_to_diagnosis, 90)),
+        } if turns_to_diagnosis else None,
+        "latency_ms": timer.percentiles(),
+        "norm_cache": semantic.cache_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kg-dir", default=str(KG_DIR))
+    parser.add_argument("--per-disease", type=int, default=10, help="每个疾病合成的会话数")
+    parser.add_argument("--max-features", type=int, default=6, help="每个会话最多说出的症状数")
+    parser.add_argument("--noise", type=float, default=0.1, help="混入无关症状的概率")
+    parser.add_argument("--paraphrase", type=float, default=0.2, help="症状被口语化改写的概率")
+    parser.add_argument("--max-turns", type=int, default=20)
+    parser.add_argument("--threshold", type=float, help="覆盖确诊阈值 diagnosis.THRESHOLD，用于观察追问策略")
+    parser.add_argument("--encoder", choices=("model", "stub"), default="model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="保留诊断接口的逐轮日志")
+    args = parser.parse_args()
+
+    _install_backends(args.encoder)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    if args.threshold is not None:
+        from app.services import diagnosis
+        diagnosis.THRESHOLD = args.threshold
+    table = load_kg(Path(args.kg_dir))
+    snapshot = _load_snapshot(table)
+    sessions = make_sessions(table, args.per_disease, args.noise, args.paraphrase, args.max_features, args.seed)
+    print(f"疾病 {len(snapshot.diseases)} 个，合成会话 {len(sessions)} 个（编码器：{args.encoder}）")
+
+    result = run(sessions, args.max_turns)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+向量索引召回率 / 延迟对比：exact（NumPy 全量内积） vs hnsw（近似最近邻）。
+
+用法（在 middleware 目录下）：
+    python -m app.services.bench_vector_index --scale 50000 --k 5
+
+--scale 大于现有词表时，用现有向量加噪声合成更多向量，模拟词表扩充后的规模。
+"""
+import argparse
+import time
+import numpy as np
+from app.services.vector_index import ExactIndex, HNSWIndex
+from app.services.vector_store import load_store
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def _synthesize(vecs: np.ndarray, n: int, noise: float, rng) -> np.ndarray:
+    if n <= len(vecs):
+        return vecs[:n]
+    base = vecs[rng.integers(0, len(vecs), n - len(vecs))]
+    extra = _normalize(base + noise * rng.standard_normal(base.shape).astype(np.float32))
+    return np.vstack([vecs, extra]).astype(np.float32)
+
+
+def _latency(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, list[float]]:
+    idxs, costs = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, idx = index.search(q[None, :], k)
+        costs.append((time.perf_counter() - t0) * 1000)
+        idxs.append(idx[0])
+    return np.array(idxs), costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=0, help="合成后的词表规模，默认使用现有词表")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--ef", type=int, default=64)
+    parser.add_argument("--m", type=int, default=16)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vecs = np.array(load_store().float_vecs())
+    vecs = _synthesize(vecs, args.scale or len(vecs), args.noise, rng)
+    queries = _normalize(
+        vecs[rng.integers(0, len(vecs), args.queries)]
+        + args.noise * rng.standard_normal((args.queries, vecs.shape[1])).astype(np.float32)
+    )
+    print(f"词表规模 {len(vecs)}，维度 {vecs.shape[1]}，查询 {len(queries)} 条，k={args.k}")
+
+    exact = ExactIndex(vecs)
+    t0 = time.perf_counter()
+    hnsw = HNSWIndex(vecs, m=args.m, ef=args.ef)
+    print(f"HNSW 建索引耗时 {time.perf_counter() - t0:.2f}s")
+
+    truth, exact_costs = _latency(exact, queries, args.k)
+    approx, hnsw_costs = _latency(hnsw, queries, args.k)
+    recall = np.mean([len(set(a) & set(t)) / args.k for a, t in zip(approx, truth)])
+    top1 = np.mean(approx[:, 0] == truth[:, 0])
+
+    for name, costs in (("exact", exact_costs), ("hnsw", hnsw_costs)):
+        p50, p99 = np.percentile(costs, [50, 99])
+        print(f"{name:>6}: p50 {p50:.3f}ms  p99 {p99:.3f}ms")
+    print(f"hnsw recall@{args.k} {recall:.4f}  top1 一致率 {top1:.4f}")
+
+
+if __name__ == "__main__":
+    main()
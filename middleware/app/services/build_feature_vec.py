@@ -1,29 +1,85 @@
-import pandas as pd
-from sentence_transformers import SentenceTransformer
+import argparse
+import hashlib
 import numpy as np
-import os
-import pickle
+import pandas as pd
+from pathlib import Path
+from onnx_encoder import backend_tag
+from vector_store import load_store, write_store
+
+MODEL_NAME  = "moka-ai/m3e-small"
+CSV_PATH    = "../../../pre-process/KG/import_data/feature.csv"
+HEADER_PATH = "feature_vec.header.json"
+VEC_DTYPE   = "float32"  # 可选 float16 / int8 量化存储
+
+def _load_model(backend: str, quantized: bool):
+    if backend == "onnx":
+        from onnx_encoder import OnnxEncoder
+        return OnnxEncoder(quantized=quantized)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME)
 
-MODEL_NAME = "moka-ai/m3e-small"
-CSV_PATH   = "../../../pre-process/KG/import_data/feature.csv"
-VEC_PATH   = "feature_vec.pkl"
+def _name_hash(name: str) -> str:
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+def _load_existing(dtype: str, backend: str) -> tuple[dict, float | None]:
+    """
+    读取现有向量存储，返回 ({featureID: (名称哈希, 向量)}, int8 量化尺度)。
+    模型、编码后端（含是否量化）或数据类型不一致时无法复用，返回空字典（即全量重建）。
+    """
+    if not Path(HEADER_PATH).exists():
+        return {}, None
+    store = load_store(HEADER_PATH)
+    if store.model != MODEL_NAME or store.backend != backend or store.header["dtype"] != dtype:
+        print(f"现有向量存储（{store.model}, {store.backend}, {store.header['dtype']}）与当前配置不一致，全量重建")
+        return {}, None
+    vecs = store.float_vecs()
+    scale = store.scale if dtype == "int8" else None
+    return {fid: (_name_hash(name), vecs[i]) for i, (fid, name) in enumerate(zip(store.ids, store.names))}, scale
 
 def main():
-    # 1. 加载模型
-    model = SentenceTransformer(MODEL_NAME)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="忽略现有向量存储，全量重新编码")
+    parser.add_argument("--dtype", default=VEC_DTYPE, choices=("float32", "float16", "int8"))
+    parser.add_argument("--backend", default="torch", choices=("torch", "onnx"),
+                        help="编码后端；onnx 需先导出模型（见 onnx_encoder.py）")
+    parser.add_argument("--onnx-fp32", action="store_true", help="onnx 后端使用未量化的模型（应与服务的 ONNX_QUANTIZED 一致）")
+    args = parser.parse_args()
+    backend = backend_tag(args.backend, not args.onnx_fp32)
 
-    # 2. 读 CSV
+    # 1. 读 CSV
     df = pd.read_csv(CSV_PATH)
     names = df["featureName"].astype(str).tolist()
     ids   = df["featureID"].astype(str).tolist()
 
-    # 3. 批量编码
-    vecs = model.encode(names, normalize_embeddings=True, show_progress_bar=True)
+    # 2. 增量比对：featureID + 名称哈希都未变的特征直接复用旧向量
+    existing, scale = ({}, None) if args.full else _load_existing(args.dtype, backend)
+    todo = [i for i, (fid, name) in enumerate(zip(ids, names))
+            if fid not in existing or existing[fid][0] != _name_hash(name)]
+    removed = len(set(existing) - set(ids))
+    print(f"共 {len(ids)} 个特征：复用 {len(ids) - len(todo)}，新增/变更 {len(todo)}，删除 {removed}")
+
+    if not todo and not removed and len(existing) == len(ids):
+        print("特征无变化，无需重建")
+        return
+    rows = [existing[fid][1] if fid in existing else None for fid in ids]
+
+    # 3. 只对新增/变更的特征批量编码
+    if todo:
+        model = _load_model(args.backend, not args.onnx_fp32)
+        fresh = model.encode([names[i] for i in todo], normalize_embeddings=True, show_progress_bar=True)
+        for i, vec in zip(todo, fresh):
+            rows[i] = vec
+        # int8 沿用现有尺度，复用的向量保持原 int8 值；新向量超出该尺度的量化范围时，
+        # 不把复用的向量换个尺度再量化一次（误差逐次累积），而是全部从文本重新编码
+        if scale is not None and np.abs(fresh).max() > 127 * scale:
+            print("新向量超出现有 int8 量化范围，全部特征重新编码")
+            rows = list(model.encode(names, normalize_embeddings=True, show_progress_bar=True))
+            scale = None
+    vecs = np.vstack(rows).astype(np.float32)
 
-    # 4. 持久化
-    with open(VEC_PATH, "wb") as f:
-        pickle.dump({"ids": ids, "names": names, "vecs": vecs}, f)
-    print(f"已保存 {len(names)} 个向量到 {VEC_PATH}")
+    # 4. 持久化（memmap 向量文件 + ID/名称表 + 头信息，头文件原子替换）
+    write_store(ids, names, vecs, MODEL_NAME, HEADER_PATH, args.dtype, backend, scale)
+    print(f"已保存 {len(names)} 个向量（{backend}）到 {HEADER_PATH}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,62 @@
+# app/services/call_stats.py
+# 按请求统计后端往返次数（Redis / Neo4j），用于压测时观察每轮对话的后端开销（BACKEND_CALL_STATS=true 时启用）
+import contextvars
+import functools
+
+BACKENDS = ("neo4j", "redis")
+_counts = contextvars.ContextVar("backend_call_counts", default=None)
+_installed = False
+
+
+def count(backend: str, n: int = 1):
+    """给当前请求的计数加 n；不在统计范围内（如启动阶段、后台线程）时忽略"""
+    counts = _counts.get()
+    if counts is not None:
+        counts[backend] = counts.get(backend, 0) + n
+
+
+def start() -> contextvars.Token:
+    # 计数字典在复制出的上下文（线程池）间共享同一个对象，同步接口在线程池中的调用也能计入
+    return _counts.set({})
+
+
+def finish(token: contextvars.Token) -> dict:
+    counts = _counts.get() or {}
+    _counts.reset(token)
+    return counts
+
+
+def header(counts: dict) -> str:
+    counts = {**dict.fromkeys(BACKENDS, 0), **counts}  # 未调用的后端也显式报 0
+    return ";".join(f"{backend}={n}" for backend, n in sorted(counts.items()))
+
+
+def install():
+    """
+    给 redis-py 的连接打补丁：每次把打包好的命令发往服务器记一次 Redis 往返，
+    pipeline / Lua 脚本整体只算一次，与网络往返次数一致。
+    """
+    global _installed
+    if _installed:
+        return
+    import redis.asyncio.connection
+    import redis.connection
+
+    def _sync(send):
+        @functools.wraps(send)
+        def wrapper(self, *args, **kwargs):
+            count("redis")
+            return send(self, *args, **kwargs)
+        return wrapper
+
+    def _async(send):
+        @functools.wraps(send)
+        async def wrapper(self, *args, **kwargs):
+            count("redis")
+            return await send(self, *args, **kwargs)
+        return wrapper
+
+    sync_cls, async_cls = redis.connection.AbstractConnection, redis.asyncio.connection.AbstractConnection
+    sync_cls.send_packed_command = _sync(sync_cls.send_packed_command)
+    async_cls.send_packed_command = _async(async_cls.send_packed_command)
+    _installed = True
@@ -0,0 +1,256 @@
+# app/services/diagnosis.py
+# 诊断流程中与 I/O 无关的步骤（实体拆分、打分、回复拼装），供同步 / 异步接口共用：
+# 接口只负责 I/O（标准化缓存、begin_turn / commit_turn），一轮的其余流程由 plan_turn / turn_response 完成
+import hashlib
+import json
+import logging
+import numpy as np
+from app.models.chat import ChatRequest, ChatResponse
+from app.services import semantic, disease_snapshot, log_setup, metrics, question_selector, session_archive
+from app.services.diagnosis_index import pack_scores, unpack_scores
+
+logger = logging.getLogger(__name__)
+
+THRESHOLD = 0.7  # 相似度阈值
+MAX_TURNS = 20   # 超过该轮数仍未确诊则结束对话
+SUGGEST_K = 5    # 每轮追问的症状数
+BATCH_CHUNK = 512  # 批量诊断每块的症状集合数：每块一次批量编码、一次矩阵乘法，内存占用与输入总量无关
+BATCH_NORM_CACHE = 50000  # 单个批次内各块共享的标准化结果条数上限（随批次结束释放，不进 worker 的 LRU）
+
+
+def split_entities(entities: list[str], retracted: list[str] = ()) -> tuple[list[tuple[str, float]], str | None, list[str]]:
+    """
+    标准化本轮实体（与撤回的实体一起批量编码），
+    返回 (已确认的 (症状, 相似度) 列表, 需要澄清的实体, 撤回的标准症状)；无法识别的撤回实体直接忽略。
+    """
+    return _split(entities, semantic.normalize_symptoms(list(entities) + list(retracted)))
+
+
+async def split_entities_async(entities: list[str], retracted: list[str], offload):
+    """split_entities 的异步版本：标准化缓存走异步 Redis，编码与检索经 offload 放到 CPU 线程池"""
+    return _split(entities, await semantic.normalize_symptoms_async(list(entities) + list(retracted), offload))
+
+
+def _split(entities: list[str], norms: list) -> tuple[list[tuple[str, float]], str | None, list[str]]:
+    confirmed = []
+    pending = None
+    for ent, norm in zip(entities, norms):
+        if norm:
+            confirmed.append(norm)
+        else:
+            pending = ent  # 需要澄清
+    withdrawn = [norm[0] for norm in norms[len(entities):] if norm]
+    return confirmed, pending, withdrawn
+
+
+def clarify_question(pending: str) -> str:
+    candidates = semantic.suggest_candidates(pending)
+    if candidates:
+        return f"您提到的“{pending}”暂未识别，请问您是指：{' 还是 '.join(candidates)}？"
+    return f"您提到的“{pending}”暂未识别，请确认具体症状？"
+
+
+def _fingerprint(symptoms) -> str:
+    return hashlib.sha1("\n".join(sorted(set(symptoms))).encode("utf-8")).hexdigest()[:16]
+
+
+@metrics.timed("score")
+def score(user_symptoms: list[str], added: list[str] | None = None, removed: list[str] = (),
+          score_state: dict | None = None):
+    """
+    返回 (诊断索引, 各疾病得分, 达到阈值的疾病列表, 新的得分状态)。
+    若会话中保存的得分状态与当前快照代号一致、且正好对应“本轮变化之前”的症状集合，
+    则只对本轮新增 / 撤回的症状做增量更新，否则（并发的另一轮已改动症状、知识表已更新、旧会话）全量重算。
+    """
+    snapshot = disease_snapshot.current()
+    index = snapshot.index
+    scores = None
+    if added is not None and score_state and score_state.get("generation") == snapshot.generation:
+        previous = (set(user_symptoms) - set(added)) | set(removed)
+        if score_state.get("fingerprint") == _fingerprint(previous):
+            scores = index.apply_delta(unpack_scores(score_state["data"], len(index.disease_ids)), added, removed)
+    if scores is None:
+        scores = index.get_scores(user_symptoms)
+    new_state = {"generation": snapshot.generation, "fingerprint": _fingerprint(user_symptoms), "data": pack_scores(scores)}
+    diagnosed = [index.diseases[disease_id] for disease_id, s in zip(index.disease_ids, scores) if s >= THRESHOLD]
+    return index, scores, diagnosed, new_state
+
+
+def diagnosis_reply(user_symptoms: list[str], diagnosed: list[dict]) -> tuple[list[str], str]:
+    names = [disease["disease_name"] for disease in diagnosed]
+    return names, f"根据症状 {', '.join(user_symptoms)}，确诊的疾病有：{', '.join(names)}"
+
+
+@metrics.timed("final_reply")
+def final_reply(index, user_symptoms: list[str]) -> tuple[list[str], str]:
+    """达到最大轮数时，给出得分最高的三个疾病（候选不足三个时按原顺序补齐）"""
+    rows, _ = index.top_k(user_symptoms, 3)
+    rows = list(rows) + [row for row in range(len(index.disease_ids)) if row not in rows][:3 - len(rows)]
+    names = [index.diseases[index.disease_ids[row]]["disease_name"] for row in rows]
+    return names, f"经过以上您提供的症状，经过分析，家禽最可能患有的疾病是：{', '.join(names)}"
+
+
+@metrics.timed("suggest")
+def suggest_symptoms(index, scores, user_symptoms: list[str], asked: list[str]) -> list[str]:
+    """按信息增益挑选下一轮追问的症状，不重复追问已有或已问过的症状"""
+    return question_selector.select(index, scores, set(user_symptoms) | set(asked), SUGGEST_K)
+
+
+def suggest_question(suggested_symptoms: list[str]) -> str:
+    return f"根据症状您的症状描述，家禽可能患有的疾病有多个。请提供更多症状以缩小范围。建议描述以下症状：{', '.join(suggested_symptoms)}"
+
+
+def plan_turn(req: ChatRequest, state: dict, turn: int, added: list[str], removed: list[str],
+              confirmed: list, pending: str | None, retracted: list[str]) -> dict:
+    """
+    一轮问诊在 begin_turn 之后、commit_turn 之前的全部计算：澄清、打分、确诊 / 达到最大轮数 / 追问。
+    不访问 Redis；返回的 plan 中 fields / finished 由接口经 commit_turn 写回会话，再交给 turn_response 生成响应。
+    调用前应已 log_setup.bind 本轮的会话标识。
+    """
+    updated_entities = state.get("entities", [])
+    logger.info("Step 1: Intent: %s, Query: %s, Entities: %s", req.intent, log_setup.digest(req.query), log_setup.digest(req.entities))
+    logger.info("Step 2: Normalized entities: %s, Retracted: %s, Pending clarification: %s", confirmed, retracted, pending)
+
+    # 本轮其余字段在返回前一次性写回 Redis
+    fields = dict(
+        intent=req.intent,
+        query=req.query,  # 记录用户的原始查询
+        pending=pending,
+    )
+    plan = dict(turn=turn, symptoms=updated_entities, fields=fields, finished=False,
+                need_clarify=False, diagnosed=False, diseases=None)
+
+    # 3. 如果需要澄清
+    if pending:
+        question = clarify_question(pending)
+        fields.update(last_question=question)
+        logger.info("Step 3: Clarification needed for: %s", pending)
+        return dict(plan, outcome="clarify", reply=question, need_clarify=True)
+
+    # 4. 无需澄清，则用已确认实体查询常驻内存的诊断索引（仅在图谱版本变化时重建）
+    user_symptoms = updated_entities
+    logger.info("Step 4: User symptoms: %s", log_setup.digest(user_symptoms))
+
+    # 5. 计算相似度（会话中保存上一轮的疾病得分，本轮只对新增 / 撤回的症状做增量更新）
+    index, similarity_scores, diagnosed_diseases, score_state = score(user_symptoms, added, removed, state.get("score_state"))
+    fields["score_state"] = score_state
+
+    if log_setup.sampled():  # 全部疾病的得分只在抽中的请求中转储
+        logger.debug("Step 5: Similarity scores: %s", dict(zip(index.disease_ids, similarity_scores.round(4).tolist())))
+    logger.info("Step 5: Diagnosed diseases: %s", [disease["disease_name"] for disease in diagnosed_diseases])
+
+    # 6. 如果确诊疾病，返回疾病和症状列表
+    if diagnosed_diseases:
+        names, reply = diagnosis_reply(user_symptoms, diagnosed_diseases)
+        fields.update(diagnosed=True, diseases=names)
+        logger.info("Step 6: Diagnosis reply: %s", reply)
+        return dict(plan, outcome="diagnosed", reply=reply, finished=True, diagnosed=True, diseases=names)
+
+    # 7. 如果未确诊且轮数 >= 20，结束对话并给出最可能的三个疾病
+    if turn >= MAX_TURNS:
+        logger.info("Step 7: Reaching max turns, ending the conversation.")
+        names, reply = final_reply(index, user_symptoms)
+        fields.update(diagnosed=False, diseases=names)
+        logger.info("Step 7: Final reply: %s", reply)
+        return dict(plan, outcome="max_turns", reply=reply, finished=True, diseases=names)
+
+    # 8. 如果未确诊，继续澄清症状
+    # 在内存中的疾病-症状矩阵上按信息增益挑选追问症状，已问过的症状记入会话不再重复
+    asked = state.get("asked") or []
+    suggested_symptoms = suggest_symptoms(index, similarity_scores, user_symptoms, asked)
+    question = suggest_question(suggested_symptoms)
+    fields.update(last_question=question, asked=asked + suggested_symptoms)
+    logger.info("Step 8: Suggested symptoms: %s", suggested_symptoms)
+    return dict(plan, outcome="follow_up", reply=question, need_clarify=True)
+
+
+def turn_response(req: ChatRequest, plan: dict, session_state: dict) -> ChatResponse:
+    """会话写回之后：归档已结束的会话、记录本轮结果，生成响应"""
+    if plan["finished"]:
+        session_archive.archive(req.user_id, req.session_id, plan["turn"], plan["outcome"], plan["symptoms"], plan["diseases"])
+    metrics.turn_outcome(plan["outcome"], plan["turn"])
+    return ChatResponse(
+        reply=plan["reply"],
+        session_state=session_state,
+        need_clarify=plan["need_clarify"],
+        diagnosed=plan["diagnosed"],
+        diseases=plan["diseases"],
+        symptoms=plan["symptoms"],  # 确保返回的 symptoms 是最新的
+    )
+
+
+def diagnose_batch(entity_lists, top_k: int = 3, chunk_size: int = BATCH_CHUNK):
+    """
+    批量诊断的进程内接口（离线分析 / 历史报告打分）：按输入顺序逐条产出结果，
+    entity_lists 可以是任意长度的迭代器，按块处理，不必一次性载入。
+    """
+    for results in batch_chunks(entity_lists, top_k, chunk_size):
+        yield from results
+
+
+def batch_chunks(entity_lists, top_k: int = 3, chunk_size: int = BATCH_CHUNK):
+    """
+    逐块产出结果列表；整个批次使用同一个知识快照，即使中途热切换，结果也彼此一致。
+    批次内各块共用一个临时的标准化结果表，跨块重复的文本只编码一次。
+    """
+    index = disease_snapshot.current().index
+    norm_cache = {}
+    chunk = []
+    for entities in entity_lists:
+        chunk.append(entities)
+        if len(chunk) >= chunk_size:
+            yield diagnose_chunk(index, chunk, top_k, norm_cache)
+            chunk = []
+    if chunk:
+        yield diagnose_chunk(index, chunk, top_k, norm_cache)
+
+
+def batch_line(position: int, item_id: str | None, result: dict) -> str:
+    """批量诊断结果的一行 NDJSON，带上在输入中的位置和调用方的记录 ID"""
+    return json.dumps({"index": position, "id": item_id, **result}, ensure_ascii=False) + "\n"
+
+
+@metrics.timed("batch_chunk")
+def diagnose_chunk(index, entity_lists: list[list[str]], top_k: int = 3, norm_cache: dict | None = None) -> list[dict]:
+    """
+    一块症状集合：全部实体一次批量标准化（相同文本只编码一次），全部集合一次矩阵乘法打分。
+    每条结果含标准化后的症状、无法识别的实体、达到阈值的疾病，以及得分为正的前 top_k 个疾病。
+    norm_cache 为批次内共享的 {实体: 标准化结果}（见 batch_chunks）。
+    """
+    flat = [entity for entities in entity_lists for entity in entities]
+    known = {} if norm_cache is None else norm_cache
+    todo = list(dict.fromkeys(entity for entity in flat if entity not in known))
+    # 历史报告文本只读标准化缓存，不写入 worker 的 LRU 与 Redis，不挤掉交互请求的热点条目
+    fresh = dict(zip(todo, semantic.normalize_symptoms(todo, fill=False)))
+    if norm_cache is not None and len(norm_cache) < BATCH_NORM_CACHE:
+        norm_cache.update(fresh)
+    norms = iter(fresh[entity] if entity in fresh else known[entity] for entity in flat)
+    symptom_sets, unrecognized = [], []
+    for entities in entity_lists:
+        symptoms, unknown = [], []
+        for entity, norm in zip(entities, norms):
+            if norm:
+                symptoms.append(norm[0])
+            else:
+                unknown.append(entity)
+        symptom_sets.append(list(dict.fromkeys(symptoms)))  # 与会话一致，按集合打分
+        unrecognized.append(unknown)
+
+    scores = index.score_batch(symptom_sets) if entity_lists else np.zeros((0, len(index.disease_ids)))
+    k = min(top_k, len(index.disease_ids))
+    results = []
+    for symptoms, unknown, row in zip(symptom_sets, unrecognized, scores):
+        top = np.lexsort((np.arange(len(row)), -row))[:k]  # 得分降序，同分按索引顺序
+        top = top[row[top] > 0]  # 与 DiagnosisIndex.top_k 一致，没有任何命中症状的疾病不列出
+        results.append({
+            "symptoms": symptoms,
+            "unrecognized": unknown,
+            "diagnosed": bool((row >= THRESHOLD).any()),
+            "diseases": [index.diseases[index.disease_ids[i]]["disease_name"] for i in np.flatnonzero(row >= THRESHOLD)],
+            "top": [
+                {"disease_id": index.disease_ids[i], "disease_name": index.diseases[index.disease_ids[i]]["disease_name"],
+                 "score": round(float(row[i]), 4)}
+                for i in top
+            ],
+        })
+    return results
@@ -0,0 +1,179 @@
+# app/services/diagnosis_index.py
+import base64
+import numpy as np
+from scipy import sparse
+
+# 与 rank_bm25.BM25Okapi 的默认参数保持一致，保证打分结果不变
+K1, B, EPSILON = 1.5, 0.75, 0.25
+
+
+def pack_scores(scores: np.ndarray) -> str:
+    """把得分向量压缩为字符串：非零疾病行号（uint32）+ 得分（float32），base64 编码后存入会话"""
+    rows = np.flatnonzero(scores)
+    return base64.b64encode(rows.astype("<u4").tobytes() + scores[rows].astype("<f4").tobytes()).decode("ascii")
+
+
+def unpack_scores(data: str, size: int) -> np.ndarray:
+    raw = base64.b64decode(data)
+    count = len(raw) // 8
+    rows = np.frombuffer(raw, dtype="<u4", count=count)
+    scores = np.zeros(size)
+    scores[rows] = np.frombuffer(raw, dtype="<f4", offset=count * 4)
+    return scores
+
+
+class DiagnosisIndex:
+    """
+    常驻内存的 BM25 诊断引擎：把疾病-症状二部图存成稀疏关联矩阵，
+    idf 与文档长度归一化都预先乘进权重矩阵 weights（疾病 × 症状），
+    单个会话打分是一次矩阵-向量乘法，批量会话是一次矩阵-矩阵乘法。
+    """
+
+    def __init__(self, diseases: dict, version: str | None = None):
+        self.version = version
+        self.diseases = diseases
+        self.disease_ids = list(diseases.keys())
+
+        # 1. 症状词表及疾病 × 症状的词频矩阵
+        self.vocab = {}
+        rows, cols = [], []
+        for i, disease in enumerate(diseases.values()):
+            for term in disease["symptoms"]:
+                rows.append(i)
+                cols.append(self.vocab.setdefault(term, len(self.vocab)))
+        shape = (len(self.disease_ids), len(self.vocab))
+        # 重复的 (行, 列) 在转换为 CSR 时会被累加，即为词频
+        tf = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=shape).tocsr()
+        tf.sum_duplicates()
+        # 疾病 × 症状 0/1 矩阵（知识表中同一疾病-症状可能重复出现，词频为 2），供追问选择估计“有该症状”的概率
+        self.presence = (tf > 0).astype(np.float64)
+        self.terms = list(self.vocab)  # 列号 -> 症状名
+
+        # 鉴别性（groupType 为 different）与同组共有（similar）症状的 疾病 × 症状 0/1 矩阵，供追问选择使用
+        self.different = self._group_matrix(diseases, "different", shape)
+        self.similar = self._group_matrix(diseases, "similar", shape)
+
+        # 2. idf（负 idf 用 epsilon * 平均 idf 兜底，同 BM25Okapi）
+        n = shape[0]
+        nd = np.bincount(tf.indices, minlength=shape[1])
+        idf = np.log(n - nd + 0.5) - np.log(nd + 0.5)
+        if len(idf):
+            idf[idf < 0] = EPSILON * idf.mean()
+        self.idf = idf
+
+        # 3. 权重矩阵：idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        doc_len = np.asarray(tf.sum(axis=1)).ravel()
+        avgdl = doc_len.mean() if n else 0.0
+        norm = K1 * (1 - B + B * doc_len / avgdl) if n else doc_len
+        weights = tf.copy()
+        row_of = np.repeat(np.arange(n), np.diff(tf.indptr))
+        weights.data = idf[tf.indices] * tf.data * (K1 + 1) / (tf.data + norm[row_of])
+        self.weights = weights
+
+        # 4. 倒排表：按症状列存储（CSC），每列即“症状 -> 含该症状的疾病及权重”，
+        #    每列的最大权重作为 MaxScore 剪枝的得分上界
+        self.postings = weights.tocsc()
+        self.postings.sort_indices()
+        self.max_weight = np.maximum(np.asarray(self.postings.max(axis=0).todense()).ravel(), 0.0) \
+            if shape[1] else np.zeros(0)
+
+    def _group_matrix(self, diseases: dict, group_type: str, shape: tuple) -> sparse.csr_matrix:
+        rows, cols = [], []
+        for i, disease in enumerate(diseases.values()):
+            for term, kind in (disease.get("group_types") or {}).items():
+                if kind == group_type and term in self.vocab:
+                    rows.append(i)
+                    cols.append(self.vocab[term])
+        matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape)
+        matrix.data[:] = 1.0
+        return matrix
+
+    def query_matrix(self, symptom_sets: list) -> sparse.csc_matrix:
+        """把若干症状集合编码为 症状 × 会话 的查询矩阵（重复症状按次数累加，未知症状忽略）"""
+        rows, cols = [], []
+        for j, symptoms in enumerate(symptom_sets):
+            for term in symptoms:
+                col = self.vocab.get(term)
+                if col is not None:
+                    rows.append(col)
+                    cols.append(j)
+        return sparse.csc_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(self.vocab), len(symptom_sets))
+        )
+
+    def _query_terms(self, symptoms: list) -> dict:
+        """症状列表 -> {列号: 出现次数}，未知症状忽略"""
+        counts = {}
+        for term in symptoms:
+            col = self.vocab.get(term)
+            if col is not None:
+                counts[col] = counts.get(col, 0) + 1
+        return counts
+
+    def _posting(self, col: int) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.postings.indptr[col], self.postings.indptr[col + 1]
+        return self.postings.indices[start:end], self.postings.data[start:end]
+
+    def get_scores(self, symptoms: list) -> np.ndarray:
+        """按 disease_ids 的顺序返回每个疾病的 BM25 得分；只累加用户症状的倒排表，不触及无关疾病"""
+        scores = np.zeros(len(self.disease_ids))
+        for col, qtf in self._query_terms(symptoms).items():
+            rows, weights = self._posting(col)
+            scores[rows] += qtf * weights  # 同一列内行号不重复
+        return scores
+
+    def apply_delta(self, scores: np.ndarray, added: list, removed: list) -> np.ndarray:
+        """
+        在上一轮的得分上增量更新：会话症状是集合，BM25 得分对各症状线性可加，
+        新增症状加上其倒排表权重、撤回症状减去，结果与对新症状集合重新打分一致。
+        """
+        scores = scores.copy()
+        for terms, sign in ((added, 1.0), (removed, -1.0)):
+            for col in self._query_terms(terms):
+                rows, weights = self._posting(col)
+                scores[rows] += sign * weights
+        return scores
+
+    def top_k(self, symptoms: list, k: int, threshold: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+        """
+        MaxScore 剪枝的 top-k：按得分上界从大到小处理用户症状的倒排表。
+        一旦剩余症状的上界之和低于当前第 k 名得分（或 threshold），只出现在剩余倒排表里的疾病已不可能进入 top-k，
+        此后只在少量候选疾病上查表累加，常见症状的长倒排表不再整条扫描；候选随时按“当前得分 + 剩余上界”淘汰。
+        返回 (疾病行号, 得分)，得分从高到低、同分按行号升序，只包含得分为正且不低于 threshold 的疾病。
+        """
+        terms = sorted(((qtf * self.max_weight[col], col, qtf) for col, qtf in self._query_terms(symptoms).items()),
+                       reverse=True)
+        # suffix[i]：第 i 个及之后症状的上界之和（由后往前累加，末尾恰为 0）
+        suffix = np.append(np.cumsum([bound for bound, _, _ in terms][::-1])[::-1], 0.0)
+        acc = np.zeros(len(self.disease_ids))
+        theta = threshold
+        best = np.zeros(0, dtype=np.int64)  # 当前前 k 名（用于抬高 theta）
+        cands = None                        # 进入剪枝阶段后的候选疾病
+        for i, (_, col, qtf) in enumerate(terms):
+            p_rows, p_weights = self._posting(col)
+            if cands is None and suffix[i] >= theta:
+                # 仍可能出现新的 top-k 疾病：整条倒排表累加
+                acc[p_rows] += qtf * p_weights
+                pool = np.concatenate([best, p_rows[~np.isin(p_rows, best)]])
+            else:
+                if cands is None:
+                    cands = np.flatnonzero(acc + suffix[i] >= theta)
+                # 只在候选疾病上查表累加
+                pos = np.minimum(np.searchsorted(p_rows, cands), len(p_rows) - 1)
+                hit = p_rows[pos] == cands
+                acc[cands[hit]] += qtf * p_weights[pos[hit]]
+                cands = cands[acc[cands] + suffix[i + 1] >= theta]
+                pool = cands
+            if k > 0 and len(pool) >= k:
+                best = pool[np.argpartition(-acc[pool], k - 1)[:k]]
+                theta = max(theta, acc[best].min())
+
+        rows = np.flatnonzero(acc) if cands is None else cands
+        rows = rows[(acc[rows] > 0) & (acc[rows] >= threshold)]
+        order = np.lexsort((rows, -acc[rows]))[:k]
+        return rows[order], acc[rows[order]]
+
+    def score_batch(self, symptom_sets: list) -> np.ndarray:
+        """批量打分，返回 会话 × 疾病 的得分矩阵，行顺序与 symptom_sets 一致"""
+        scores = self.weights @ self.query_matrix(symptom_sets)
+        return np.asarray(scores.T.todense())
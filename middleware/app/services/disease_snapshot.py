@@ -0,0 +1,94 @@
+# app/services/disease_snapshot.py
+import logging
+import threading
+from types import MappingProxyType
+from app.services import redis_service
+from app.services.diagnosis_index import DiagnosisIndex
+
+logger = logging.getLogger(__name__)
+
+
+class DiseaseSnapshot:
+    """
+    进程内不可变的疾病知识快照：disease_id -> {disease_name, symptoms, group_types}，
+    以及由它构建的诊断索引。请求只读取当前快照，不再访问 Redis；
+    知识表更新时整体替换为新快照（generation 递增），旧快照仍可被进行中的请求安全使用。
+    """
+
+    def __init__(self, generation: int, version: str | None, table: dict):
+        if not table:
+            # 空表意味着预加载没有成功，不能以 0 个疾病报告就绪
+            raise RuntimeError(f"疾病知识表为空（代号 {generation}），预加载可能失败")
+        self.generation = generation
+        self.version = version
+        self.diseases = MappingProxyType({
+            disease_id: MappingProxyType({
+                "disease_name": record["disease_name"],
+                "symptoms": tuple(record["symptoms"]),
+                # groupType: similar（同组疾病共有的症状）/ different（用于鉴别的症状）
+                "group_types": MappingProxyType(dict(zip(record["symptoms"], record.get("group_types") or ()))),
+            })
+            for disease_id, record in table.items()
+        })
+        self.index = DiagnosisIndex(self.diseases, version)
+
+
+_current = None
+_lock = threading.Lock()
+_listener = None
+_stop = threading.Event()
+
+
+def load() -> DiseaseSnapshot:
+    """从 Redis 读取知识表并替换当前快照（启动时在预加载之后调用）"""
+    global _current
+    generation, version, table = redis_service.get_disease_table()
+    snapshot = DiseaseSnapshot(generation, version, table)
+    with _lock:
+        if _current is None or snapshot.generation >= _current.generation:
+            _current = snapshot
+    logger.info(f"疾病知识快照已加载：代号 {snapshot.generation}，{len(snapshot.diseases)} 个疾病")
+    return _current
+
+
+def current() -> DiseaseSnapshot:
+    return _current if _current is not None else load()
+
+
+def _refresh_if_stale():
+    generation = redis_service.get_disease_generation()
+    if _current is None or generation != _current.generation:
+        load()
+
+
+def _listen():
+    """订阅知识表更新频道；断线重连后先比对一次代号，避免漏掉断线期间的更新"""
+    backoff = 1.0
+    while not _stop.is_set():
+        try:
+            pubsub = redis_service.r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(redis_service.DISEASE_CHANNEL)
+            _refresh_if_stale()
+            backoff = 1.0
+            while not _stop.is_set():
+                if pubsub.get_message(timeout=1.0):
+                    _refresh_if_stale()
+            pubsub.close()
+        except Exception:
+            logger.exception(f"疾病知识更新订阅异常，{backoff:.0f} 秒后重连")
+            _stop.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+
+def start_listener():
+    global _listener
+    if _listener is None or not _listener.is_alive():
+        _stop.clear()
+        _listener = threading.Thread(target=_listen, name="disease-snapshot-listener", daemon=True)
+        _listener.start()
+
+
+def stop_listener():
+    _stop.set()
+    if _listener is not None:
+        _listener.join(timeout=5)
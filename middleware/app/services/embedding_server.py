@@ -0,0 +1,171 @@
+# app/services/embedding_server.py
+"""
+共享编码服务（sidecar）：整台机器只加载一份编码模型，
+通过 Unix socket 接收所有 uvicorn worker 的编码请求，在很短的时间窗口内攒批后一次前向。
+
+协议（每个连接上可连续收发多帧）：
+    请求  4 字节大端长度 + UTF-8 JSON 文本列表
+    响应  4 字节大端条数 n + 4 字节维度 d + n*d 个小端 float32；
+          n 为 0xFFFFFFFF 时表示出错，后跟 4 字节长度 + UTF-8 错误信息
+
+用法（在 middleware 目录下）：
+    python -m app.services.embedding_server --socket /tmp/poultry-embed.sock
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_ERROR = 0xFFFFFFFF
+
+
+# ---- 客户端（encoder.py）与服务端共用的帧编解码 ----
+
+def _recv_exact(conn, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = conn.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("编码服务连接已关闭")
+        buf += chunk
+    return bytes(buf)
+
+
+def send_texts(conn, texts: list[str]):
+    payload = json.dumps(texts, ensure_ascii=False).encode("utf-8")
+    conn.sendall(struct.pack(">I", len(payload)) + payload)
+
+
+def recv_embeddings(conn) -> np.ndarray:
+    count, dim = struct.unpack(">II", _recv_exact(conn, 8))
+    if count == _ERROR:
+        message = _recv_exact(conn, dim).decode("utf-8")
+        raise RuntimeError(f"编码服务出错: {message}")
+    return np.frombuffer(_recv_exact(conn, count * dim * 4), dtype="<f4").reshape(count, dim)
+
+
+def _pack_embeddings(vecs: np.ndarray) -> bytes:
+    vecs = np.ascontiguousarray(vecs, dtype="<f4")
+    return struct.pack(">II", *vecs.shape) + vecs.tobytes()
+
+
+def _pack_error(message: str) -> bytes:
+    payload = message.encode("utf-8")
+    return struct.pack(">II", _ERROR, len(payload)) + payload
+
+
+# ---- 服务端 ----
+
+class MicroBatcher:
+    """
+    收集各连接的编码请求：第一条请求到达后最多再等 window 秒，或累计达到 max_items 条文本，
+    即合并为一批前向，再按请求切分结果。前向在单独线程中执行，不阻塞事件循环继续收集下一批。
+    """
+
+    def __init__(self, encode_fn, window: float, max_items: int):
+        self.encode_fn = encode_fn
+        self.window = window
+        self.max_items = max_items
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, texts: list[str]) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            size = len(pending[0][0])
+            deadline = loop.time() + self.window
+            while size < self.max_items:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            texts = [text for batch, _ in pending for text in batch]
+            try:
+                vecs = await loop.run_in_executor(self.executor, self.encode_fn, texts)
+            except Exception as e:
+                logger.exception("批量编码失败")
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(texts)
+            offset = 0
+            for batch, future in pending:
+                if not future.done():
+                    future.set_result(vecs[offset:offset + len(batch)])
+                offset += len(batch)
+
+
+async def _handle(batcher: MicroBatcher, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                (length,) = struct.unpack(">I", await reader.readexactly(4))
+                texts = json.loads(await reader.readexactly(length))
+            except asyncio.IncompleteReadError:
+                break
+            try:
+                writer.write(_pack_embeddings(await batcher.submit(texts)))
+            except Exception as e:
+                writer.write(_pack_error(f"{type(e).__name__}: {e}"))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(path: str, encode_fn, window: float, max_items: int):
+    batcher = MicroBatcher(encode_fn, window, max_items)
+    if os.path.exists(path):
+        os.unlink(path)  # 清理上次异常退出残留的 socket 文件
+    server = await asyncio.start_unix_server(lambda r, w: _handle(batcher, r, w), path=path)
+    os.chmod(path, 0o660)
+    logger.info(f"编码服务已启动：{path}，攒批窗口 {window * 1000:.1f}ms，单批上限 {max_items}")
+    async with server:
+        await asyncio.gather(server.serve_forever(), batcher.run())
+
+
+def main():
+    from app.config import settings
+    from app.services.encoder import load_model
+
+    parser = argparse.ArgumentParser(description="共享编码服务（Unix socket + 微批处理）")
+    parser.add_argument("--socket", default=settings.embed_socket)
+    parser.add_argument("--window-ms", type=float, default=settings.embed_batch_window_ms)
+    parser.add_argument("--max-batch", type=int, default=settings.embed_batch_max)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    t0 = time.perf_counter()
+    model = load_model()
+    logger.info(f"模型加载完成（{settings.encoder_backend}），耗时 {time.perf_counter() - t0:.2f}s")
+
+    def encode_fn(texts):
+        return model.encode(texts, normalize_embeddings=True, batch_size=max(len(texts), 1))
+
+    asyncio.run(serve(args.socket, encode_fn, args.window_ms / 1000, args.max_batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# app/services/encoder.py
+# 症状文本编码入口：local 在本进程加载模型；sidecar 经 Unix socket 交给共享的编码服务（embedding_server）微批处理；
+# 模型本身可选 PyTorch 或 ONNX 后端（ENCODER_BACKEND）
+import socket
+import threading
+import numpy as np
+from app.config import settings
+from app.services.embedding_server import recv_embeddings, send_texts
+from app.services.onnx_encoder import backend_tag
+from app.services.vector_store import HEADER_PATH, read_header
+
+WARMUP_TEXTS = ["咳嗽", "流鼻涕", "精神沉郁"]  # 预热编码器用的示例实体
+
+_model = None
+_model_lock = threading.Lock()
+_local = threading.local()  # sidecar 模式下每个线程复用一条连接
+
+
+def load_model():
+    """按 ENCODER_BACKEND 加载本地编码模型：torch（SentenceTransformer）或 onnx（onnxruntime，可 int8 量化）"""
+    if settings.encoder_backend == "onnx":
+        from app.services.onnx_encoder import MODEL_DIR, OnnxEncoder
+        return OnnxEncoder(settings.onnx_model_dir or MODEL_DIR, settings.onnx_quantized, settings.onnx_threads)
+    from sentence_transformers import SentenceTransformer  # 导入 torch 较慢，推迟到加载模型时
+    return SentenceTransformer(read_header(HEADER_PATH)["model"])
+
+
+def backend() -> str:
+    """当前编码后端标识（torch / onnx-int8 / onnx-fp32）；sidecar 与本进程使用相同的 ENCODER_BACKEND 配置"""
+    return backend_tag(settings.encoder_backend, settings.onnx_quantized)
+
+
+def _get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model()
+    return _model
+
+
+def _connect() -> socket.socket:
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(settings.embed_timeout)
+    conn.connect(settings.embed_socket)
+    return conn
+
+
+def _encode_sidecar(texts: list[str]) -> np.ndarray:
+    # 连接可能因编码服务重启而失效，重连一次后再报错
+    for attempt in range(2):
+        conn = getattr(_local, "conn", None)
+        try:
+            if conn is None:
+                conn = _local.conn = _connect()
+            send_texts(conn, texts)
+            return recv_embeddings(conn)
+        except OSError as e:
+            if conn is not None:
+                conn.close()
+            _local.conn = None
+            if attempt:
+                raise RuntimeError(f"编码服务不可用（{settings.embed_socket}）: {e}") from e
+
+
+def encode(texts: list[str]) -> np.ndarray:
+    """返回 L2 归一化的 float32 向量，形状 (len(texts), dim)"""
+    if settings.encoder_mode == "sidecar":
+        return _encode_sidecar(texts)
+    return np.asarray(_get_model().encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+
+def warmup():
+    """加载编码器（或连通编码服务）并做一次前向，避免首个请求承担初始化开销"""
+    encode(WARMUP_TEXTS)
@@ -0,0 +1,178 @@
+# app/services/idempotency.py
+# 诊断请求的幂等去重：Dify 循环节点超时后会重试同一次 HTTP 调用，重试不应再次编码、打分和自增轮次。
+# 去重键为 (user_id, session_id, 请求 ID)，没有请求 ID 时用 (query, intent, entities, retracted_entities) 的哈希：
+# - 第一个请求在 Redis 中占位（pending），算完后把 ChatResponse 写回同一个 key，保留 IDEMPOTENCY_TTL 秒，
+#   窗口内的重试直接返回缓存的响应；
+# - 同一 worker 内并发的重复请求等待进行中的计算（Future），其他 worker 上的则轮询 Redis 等待占位者写回；
+# - 占位者失败时删除占位，等待者重新竞争；占位保留 IDEMPOTENCY_PENDING_TTL 秒（不短于上游请求超时），
+#   只有占位者崩溃、占位过期后才会由重试重新计算，慢请求不会因占位过期被重复执行、重复自增轮次；
+# - 等待超过 IDEMPOTENCY_WAIT 仍未算完时抛出 RequestInFlight（503 + Retry-After），由上游稍后重试取缓存结果，
+#   而不是再算一遍。
+# 窗口内用户原样重发同一句话也会拿到同一个回复，这正是重试语义所需要的。
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from app.config import settings
+from app.models.chat import ChatRequest, ChatResponse
+from app.services import metrics, redis_async, redis_service
+from app.services.redis_service import _RELEASE_LOCK_LUA
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending:"
+POLL_INTERVAL = (0.01, 0.2)  # 轮询其他 worker 结果的初始 / 最大间隔（秒）
+
+# 已有值（缓存的响应或他人的占位）则返回该值，否则写入占位并返回 nil，一次往返完成“查缓存 + 占位”
+_CLAIM_LUA = """
+local value = redis.call('GET', KEYS[1])
+if value then return value end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return false
+"""
+_claim_script = redis_service.r.register_script(_CLAIM_LUA)
+_release_script = redis_service.r.register_script(_RELEASE_LOCK_LUA)
+_claim_script_async = redis_async.r.register_script(_CLAIM_LUA)
+_release_script_async = redis_async.r.register_script(_RELEASE_LOCK_LUA)
+
+_lock = threading.Lock()
+_inflight = {}        # 去重键 -> Future（同步接口，本 worker 内进行中的请求）
+_inflight_async = {}  # 去重键 -> asyncio.Future（异步接口）
+
+
+class RequestInFlight(Exception):
+    """同一请求仍在计算中，等待超时；返回可重试的状态码，重试时取缓存的响应"""
+
+    def __init__(self, key: str):
+        super().__init__(f"同一请求仍在处理中：{key}")
+        self.key = key
+
+
+def request_key(req: ChatRequest) -> str:
+    if req.request_id:
+        digest = hashlib.sha1(f"id:{req.request_id}".encode("utf-8")).hexdigest()[:16]
+    else:
+        content = json.dumps([req.query, req.intent, req.entities or [], req.retracted_entities or []], ensure_ascii=False)
+        digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+    return f"idem:{req.user_id}:{req.session_id}:{digest}"
+
+
+def _cached(value: str | None) -> ChatResponse | None:
+    if value and not value.startswith(PENDING):
+        return ChatResponse.model_validate_json(value)
+    return None
+
+
+def _args(token: str) -> list:
+    return [token, int(settings.idempotency_pending_ttl * 1000)]
+
+
+def run(req: ChatRequest, compute) -> ChatResponse:
+    """同步接口：对重复请求返回缓存的响应或等待进行中的计算，否则执行 compute(req) 并缓存结果"""
+    if settings.idempotency_ttl <= 0:
+        return compute(req)
+    key = request_key(req)
+    with _lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        metrics.duplicate("coalesced")
+        logger.info("重复请求，等待进行中的同一请求：%s", key)
+        try:
+            return future.result(timeout=settings.idempotency_wait)
+        except FutureTimeout:
+            raise RequestInFlight(key) from None
+    try:
+        response = _run_once(key, req, compute)
+        future.set_result(response)
+        return response
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+def _run_once(key: str, req: ChatRequest, compute) -> ChatResponse:
+    token = f"{PENDING}{uuid.uuid4().hex}"
+    deadline = time.monotonic() + settings.idempotency_wait
+    interval = POLL_INTERVAL[0]
+    while True:
+        value = _claim_script(keys=[key], args=_args(token))
+        if value is None:
+            break
+        response = _cached(value)
+        if response is not None:
+            metrics.duplicate("cached")
+            logger.info("重复请求，返回缓存的响应：%s", key)
+            return response
+        if time.monotonic() >= deadline:
+            raise RequestInFlight(key)
+        time.sleep(interval)
+        interval = min(interval * 2, POLL_INTERVAL[1])
+    try:
+        response = compute(req)
+    except BaseException:
+        _release_script(keys=[key], args=[token])
+        raise
+    redis_service.r.set(key, response.model_dump_json(), ex=settings.idempotency_ttl)
+    return response
+
+
+async def run_async(req: ChatRequest, compute) -> ChatResponse:
+    """异步接口版本，compute 为协程函数"""
+    if settings.idempotency_ttl <= 0:
+        return await compute(req)
+    key = request_key(req)
+    future = _inflight_async.get(key)
+    if future is not None:
+        metrics.duplicate("coalesced")
+        logger.info("重复请求，等待进行中的同一请求：%s", key)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), settings.idempotency_wait)
+        except asyncio.TimeoutError:
+            raise RequestInFlight(key) from None
+    future = _inflight_async[key] = asyncio.get_running_loop().create_future()
+    try:
+        response = await _run_once_async(key, req, compute)
+        future.set_result(response)
+        return response
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # 没有等待者时也标记为已取出，避免 "exception was never retrieved" 警告
+        raise
+    finally:
+        _inflight_async.pop(key, None)
+
+
+async def _run_once_async(key: str, req: ChatRequest, compute) -> ChatResponse:
+    token = f"{PENDING}{uuid.uuid4().hex}"
+    deadline = time.monotonic() + settings.idempotency_wait
+    interval = POLL_INTERVAL[0]
+    while True:
+        value = await _claim_script_async(keys=[key], args=_args(token))
+        if value is None:
+            break
+        response = _cached(value)
+        if response is not None:
+            metrics.duplicate("cached")
+            logger.info("重复请求，返回缓存的响应：%s", key)
+            return response
+        if time.monotonic() >= deadline:
+            raise RequestInFlight(key)
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, POLL_INTERVAL[1])
+    try:
+        response = await compute(req)
+    except BaseException:
+        await _release_script_async(keys=[key], args=[token])
+        raise
+    await redis_async.r.set(key, response.model_dump_json(), ex=settings.idempotency_ttl)
+    return response
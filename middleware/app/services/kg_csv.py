@@ -0,0 +1,35 @@
+# app/services/kg_csv.py
+# 知识图谱导入数据（pre-process/KG/import_data 下的 CSV）的读取，
+# 供 GRAPH_SOURCE=csv 时代替 Neo4j 预加载（本地压测 / 开发），以及离线基准合成会话使用
+import csv
+import hashlib
+from pathlib import Path
+
+KG_DIR = Path(__file__).resolve().parents[3] / "pre-process" / "KG" / "import_data"
+KG_FILES = ("disease.csv", "feature.csv", "relation.csv")
+
+
+def load_kg(kg_dir: Path = KG_DIR) -> dict:
+    """读取 disease.csv / feature.csv / relation.csv，返回 disease_id -> {disease_name, symptoms, group_types}"""
+    kg_dir = Path(kg_dir)
+    with open(kg_dir / "disease.csv", encoding="utf-8") as f:
+        diseases = {row["diseaseID"]: row["diseaseName"] for row in csv.DictReader(f)}
+    with open(kg_dir / "feature.csv", encoding="utf-8") as f:
+        features = {row["featureID"]: row["featureName"] for row in csv.DictReader(f)}
+    table = {}
+    with open(kg_dir / "relation.csv", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            record = table.setdefault(row["diseaseID"], {
+                "disease_name": diseases.get(row["diseaseID"], row["diseaseID"]), "symptoms": [], "group_types": [],
+            })
+            record["symptoms"].append(features[row["featureID"]])
+            record["group_types"].append(row["groupType"])
+    return table
+
+
+def kg_stamp(kg_dir: Path = KG_DIR) -> str:
+    """CSV 内容哈希，作为图谱戳（与 Neo4j 的内容戳同样用于判断是否需要重新预加载）"""
+    digest = hashlib.sha1()
+    for name in KG_FILES:
+        digest.update((Path(kg_dir) / name).read_bytes())
+    return f"csv:{digest.hexdigest()[:16]}"
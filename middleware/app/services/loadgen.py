@@ -0,0 +1,201 @@
+"""
+/api/chat/diagnose 压测工具：由知识图谱导入数据合成多轮问诊会话（见 bench_diagnosis.make_sessions），
+按泊松到达率并发发起大量会话，轮次之间加入随机思考时间，统计 RPS、按轮次划分的延迟直方图与分位数、
+错误率，以及每轮的 Redis / Neo4j 往返次数（服务端需开启 BACKEND_CALL_STATS=true）。
+
+依赖（可选）：pip install httpx
+
+本地实例（本地 Redis；GRAPH_SOURCE=csv 直接读取导入 CSV 代替 Neo4j），在 middleware 目录下：
+    GRAPH_SOURCE=csv BACKEND_CALL_STATS=true REDIS_URL=redis://localhost:6379/0 \\
+    NEO4J_URI=bolt://unused NEO4J_USER=neo4j NEO4J_PASSWORD=unused \\
+    uvicorn app.main:app --port 8000 --workers 4
+
+压测：
+    python -m app.services.loadgen --base-url http://127.0.0.1:8000 --sessions 2000 --rate 100 --think-time 1
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+import numpy as np
+from app.services.bench_diagnosis import PARAPHRASES, make_sessions, next_entities
+from app.services.kg_csv import KG_DIR, load_kg
+
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, math.inf)
+
+
+def _parse_calls(value: str | None) -> dict:
+    """解析响应头 X-Backend-Calls，如 "neo4j=0;redis=2" """
+    calls = {}
+    for item in filter(None, (value or "").split(";")):
+        backend, _, n = item.partition("=")
+        calls[backend] = int(n)
+    return calls
+
+
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)    # 轮次 -> 延迟（毫秒）
+        self.errors = defaultdict(Counter)  # 轮次 -> 错误类型计数
+        self.calls = defaultdict(lambda: defaultdict(list))  # 轮次 -> 后端 -> 每次请求的往返次数
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.sessions_done = 0
+
+    def add(self, turn: int, ms: float, error: str | None, calls: dict):
+        self.latency[turn].append(ms)
+        if error:
+            self.errors[turn][error] += 1
+        for backend, n in calls.items():
+            self.calls[turn][backend].append(n)
+
+    def report(self, elapsed: float) -> dict:
+        requests = sum(len(v) for v in self.latency.values())
+        errors = sum(sum(c.values()) for c in self.errors.values())
+        all_latency = [ms for values in self.latency.values() for ms in values]
+        per_turn = {}
+        for turn in sorted(self.latency):
+            values = np.array(self.latency[turn])
+            hist = np.histogram(values, bins=(0,) + BUCKETS_MS)[0]
+            per_turn[turn] = {
+                "requests": len(values),
+                "errors": sum(self.errors[turn].values()),
+                "p50_ms": round(float(np.percentile(values, 50)), 2),
+                "p90_ms": round(float(np.percentile(values, 90)), 2),
+                "p99_ms": round(float(np.percentile(values, 99)), 2),
+                "max_ms": round(float(values.max()), 2),
+                "histogram_ms": {f"<={b}" if b != math.inf else ">5000": int(n) for b, n in zip(BUCKETS_MS, hist)},
+                "backend_calls_mean": {backend: round(float(np.mean(ns)), 2) for backend, ns in self.calls[turn].items()},
+            }
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "sessions": self.sessions_done,
+            "requests": requests,
+            "rps": round(requests / elapsed, 2) if elapsed else None,
+            "error_rate": round(errors / requests, 4) if requests else None,
+            "errors": dict(sum((c for c in self.errors.values()), Counter())),
+            "peak_in_flight": self.peak_in_flight,
+            "latency_ms": {
+                f"p{q}": round(float(np.percentile(all_latency, q)), 2) for q in (50, 90, 99)
+            } if all_latency else None,
+            "per_turn": per_turn,
+        }
+
+
+async def _run_session(client, session: dict, run_id: str, args, recorder: Recorder, rng: random.Random):
+    reserve = list(session["reserve"])
+    entities = list(session["opening"])
+    session_id = f"{run_id}-{session['session_id']}"
+    for turn in range(1, args.max_turns + 1):
+        payload = {"user_id": "loadgen", "session_id": session_id, "query": "，".join(entities),
+                   "intent": "diagnose", "entities": entities}
+        recorder.in_flight += 1
+        recorder.peak_in_flight = max(recorder.peak_in_flight, recorder.in_flight)
+        t0 = time.perf_counter()
+        error, body, calls = None, None, {}
+        try:
+            resp = await client.post("/api/chat/diagnose", json=payload)
+            calls = _parse_calls(resp.headers.get("x-backend-calls"))
+            if resp.status_code == 200:
+                body = resp.json()
+            else:
+                error = f"http_{resp.status_code}"
+        except Exception as e:
+            error = type(e).__name__
+        finally:
+            recorder.in_flight -= 1
+        recorder.add(turn, (time.perf_counter() - t0) * 1000, error, calls)
+        if error or body["diagnosed"] or body.get("diseases"):
+            break
+        entities = next_entities(session, reserve, body["reply"], body["session_state"])
+        if not entities:
+            break
+        if args.think_time > 0:
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+    recorder.sessions_done += 1
+
+
+async def _wait_ready(client, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"服务在 {timeout}s 内未就绪")
+
+
+async def run(args) -> dict:
+    try:
+        import httpx
+    except ImportError as e:
+        raise RuntimeError("压测工具需要安装 httpx：pip install httpx") from e
+
+    table = load_kg(Path(args.kg_dir))
+    per_disease = math.ceil(args.sessions / len(table))
+    pool = make_sessions(table, per_disease, args.noise, args.paraphrase, seed=args.seed)
+    rng = random.Random(args.seed)
+    sessions = rng.sample(pool, args.sessions)
+    run_id = uuid.uuid4().hex[:8]  # 避免与历史会话的 session_id 冲突
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        if not args.no_wait_ready:
+            await _wait_ready(client, args.ready_timeout)
+        print(f"开始压测：{len(sessions)} 个会话，到达率 {args.rate}/s，思考时间均值 {args.think_time}s，run_id {run_id}")
+        t0 = time.perf_counter()
+        tasks = []
+        for session in sessions:
+            tasks.append(asyncio.create_task(_run_session(client, session, run_id, args, recorder, rng)))
+            if args.rate > 0:
+                await asyncio.sleep(rng.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+        return recorder.report(time.perf_counter() - t0)
+
+
+def _print_report(result: dict):
+    print(f"耗时 {result['elapsed_s']}s，会话 {result['sessions']}，请求 {result['requests']}，"
+          f"RPS {result['rps']}，错误率 {result['error_rate']}，峰值并发 {result['peak_in_flight']}")
+    if result["errors"]:
+        print(f"错误：{result['errors']}")
+    print(f"{'轮次':>4} {'请求':>7} {'错误':>5} {'p50ms':>8} {'p90ms':>8} {'p99ms':>8} {'maxms':>8}  后端往返（均值）")
+    for turn, row in result["per_turn"].items():
+        calls = " ".join(f"{k}={v}" for k, v in sorted(row["backend_calls_mean"].items())) or "-"
+        print(f"{turn:>4} {row['requests']:>7} {row['errors']:>5} {row['p50_ms']:>8} {row['p90_ms']:>8} "
+              f"{row['p99_ms']:>8} {row['max_ms']:>8}  {calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=1000, help="会话总数")
+    parser.add_argument("--rate", type=float, default=50.0, help="会话到达率（个/秒，泊松到达），0 表示同时开始")
+    parser.add_argument("--think-time", type=float, default=1.0, help="轮次间思考时间均值（秒，指数分布）")
+    parser.add_argument("--max-turns", type=int, default=20)
+    parser.add_argument("--connections", type=int, default=200, help="HTTP 连接池上限")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--noise", type=float, default=0.1)
+    parser.add_argument("--paraphrase", type=float, default=0.2, help=f"症状口语化改写概率（模板：{' / '.join(PARAPHRASES)}）")
+    parser.add_argument("--kg-dir", default=str(KG_DIR))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-wait-ready", action="store_true", help="不等待 /ready")
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="把完整结果（含直方图）写入 JSON 文件")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    _print_report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# app/services/log_setup.py
+# 中间件的日志子系统：
+# - 所有记录经 QueueHandler 放入有界队列，由后台 QueueListener 线程序列化并写文件，请求线程不做磁盘 I/O；
+#   队列满（磁盘卡顿）时丢弃并计数，不阻塞请求
+# - 输出 JSON lines，自动带上当前请求绑定的 user_id / session_id / turn
+# - 大对象用 digest() 包装，只在真正输出时才序列化，超长时只保留前缀、长度与摘要
+# - 逐请求的调试转储（各疾病得分等）按 LOG_SAMPLE_RATE 抽样，未抽中的请求由 sampled() 守卫，连字符串都不构造
+import atexit
+import contextvars
+import copy
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler, WatchedFileHandler
+from app.config import settings
+
+_context = contextvars.ContextVar("log_context", default=None)
+_listeners = []
+dropped = 0  # 因队列已满被丢弃的日志条数
+
+
+def bind(user_id: str, session_id: str, turn: int | None = None):
+    """绑定当前请求的会话标识（本请求之后的日志都带上这些字段），并决定本请求是否抽中调试转储"""
+    rate = settings.log_sample_rate
+    _context.set({
+        "user_id": user_id,
+        "session_id": session_id,
+        "turn": turn,
+        "sampled": rate > 0 and random.random() < rate,
+    })
+
+
+def sampled() -> bool:
+    """当前请求是否输出调试转储"""
+    ctx = _context.get()
+    return bool(ctx and ctx["sampled"])
+
+
+class digest:
+    """大对象的延迟表示：日志真正输出时才序列化；超过 limit 个字符时只保留前缀、总长度与 sha1 摘要"""
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = 256):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else json.dumps(self.value, ensure_ascii=False, default=str)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}…(len={len(text)}, sha1={hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]})"
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON；extra={"fields": {...}} 传入的结构化字段合并到顶层"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        ctx = getattr(record, "ctx", None)
+        if ctx:
+            entry.update(user_id=ctx["user_id"], session_id=ctx["session_id"], turn=ctx["turn"])
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """在请求线程只做最少的工作：取出上下文、拼好消息，序列化与写盘交给监听线程"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 参数可能是之后会被修改的可变对象，必须在入队前拼好消息
+        message = record.getMessage()
+        exc_text = self.formatter.formatException(record.exc_info) if record.exc_info else record.exc_text
+        record = copy.copy(record)
+        record.msg, record.args, record.exc_info, record.exc_text = message, None, None, exc_text
+        record.ctx = _context.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+def setup():
+    """为根 logger 安装队列处理器并启动写日志的监听线程（重复调用无副作用）"""
+    root = logging.getLogger()
+    if any(isinstance(h, _QueueHandler) for h in root.handlers):
+        return
+    if settings.log_file:
+        os.makedirs(os.path.dirname(settings.log_file), exist_ok=True)
+        # 每天午夜轮转，保留 7 天
+        handler = TimedRotatingFileHandler(settings.log_file, when="midnight", interval=1, backupCount=7, encoding="utf-8")
+        handler.suffix = "%Y-%m-%d"
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    root.addHandler(_queued(handler))
+    root.setLevel(settings.log_level.upper())
+    if settings.log_sample_rate > 0:
+        # 调试转储以 DEBUG 级别输出，抽样开启时放开 app.* 的 DEBUG（转储都有 sampled() 守卫）
+        logging.getLogger("app").setLevel(logging.DEBUG)
+
+
+def file_logger(name: str, path: str) -> logging.Logger:
+    """
+    独立的追加写文件 logger（如会话归档）：消息原样写为一行，不向根 logger 传递，同样经队列由后台线程写盘。
+    使用 WatchedFileHandler，文件被外部轮转（logrotate）后自动重新打开；多个 worker 以追加模式写同一文件。
+    """
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        handler = WatchedFileHandler(path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(_queued(handler))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def _queued(handler: logging.Handler) -> _QueueHandler:
+    """把 handler 放到后台监听线程之后，返回请求线程使用的队列处理器"""
+    queue_handler = _QueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+    queue_handler.setFormatter(logging.Formatter())
+    listener = QueueListener(queue_handler.queue, handler)
+    listener.start()
+    if not _listeners:
+        atexit.register(stop)
+    _listeners.append(listener)
+    return queue_handler
+
+
+def stop():
+    """停止监听线程，写完队列中剩余的日志"""
+    while _listeners:
+        _listeners.pop().stop()
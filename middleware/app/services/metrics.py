@@ -0,0 +1,131 @@
+# app/services/metrics.py
+# 诊断流程的 Prometheus 指标（METRICS_ENABLED=true 时启用，需 pip install prometheus_client）：
+# 各阶段耗时直方图、症状标准化缓存命中、每轮结果与会话轮数，由 /metrics 导出。
+# 多个 uvicorn worker 时在启动前设置 PROMETHEUS_MULTIPROC_DIR（指向一个清空的目录），
+# 各 worker 把数据写入该目录下的 mmap 文件，/metrics 汇总所有 worker。
+# 未启用时 timed 直接返回原函数、timer 返回空上下文，热路径上没有额外开销。
+import contextlib
+import functools
+import inspect
+import os
+import time
+from app.config import settings
+
+# 阶段耗时分桶（秒）：从缓存命中的亚毫秒级到冷启动编码的秒级
+STAGE_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5)
+# 会话结束（确诊或达到最大轮数）时的轮数分桶
+TURN_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20)
+
+enabled = settings.metrics_enabled
+_stage_seconds = None
+_turns = None
+_session_turns = None
+_cache_lookups = None
+_duplicates = None
+_children = {}  # 已解析的带标签子指标，避免每次 observe 都经过 labels() 查找
+_NULL = contextlib.nullcontext()
+
+
+def _init():
+    global _stage_seconds, _turns, _session_turns, _cache_lookups, _duplicates
+    try:
+        from prometheus_client import Counter, Histogram
+    except ImportError as e:
+        raise RuntimeError("METRICS_ENABLED=true 需要安装 prometheus_client：pip install prometheus_client") from e
+    _stage_seconds = Histogram("diagnose_stage_seconds", "诊断流程各阶段耗时", ["stage"], buckets=STAGE_BUCKETS)
+    _turns = Counter("diagnose_turns_total", "按结果统计的对话轮次（clarify / follow_up / diagnosed / max_turns）", ["outcome"])
+    _session_turns = Histogram("diagnose_session_turns", "会话结束（确诊或达到最大轮数）时的轮数", buckets=TURN_BUCKETS)
+    _cache_lookups = Counter("symptom_norm_cache_lookups_total", "症状标准化缓存查询（lru_hit / redis_hit / miss）", ["result"])
+    _duplicates = Counter("diagnose_duplicates_total", "重复的诊断请求（cached：返回缓存的响应 / coalesced：等待进行中的同一请求）", ["result"])
+
+
+if enabled:
+    _init()
+
+
+def _child(metric, label: str):
+    child = _children.get((metric, label))
+    if child is None:
+        child = _children[(metric, label)] = metric.labels(label)
+    return child
+
+
+class _Timer:
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0)
+
+
+def timer(stage: str):
+    """上下文管理器：记录 with 块的耗时到 diagnose_stage_seconds{stage=...}"""
+    if not enabled:
+        return _NULL
+    return _Timer(_child(_stage_seconds, stage))
+
+
+def timed(stage: str):
+    """装饰器：记录函数（同步或 async）每次调用的耗时；未启用时原样返回函数"""
+    def decorate(func):
+        if not enabled:
+            return func
+        hist = _child(_stage_seconds, stage)
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    hist.observe(time.perf_counter() - t0)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - t0)
+        return wrapper
+    return decorate
+
+
+def turn_outcome(outcome: str, turn: int):
+    """记录本轮结果；确诊或达到最大轮数即会话结束，同时记录会话轮数"""
+    if not enabled:
+        return
+    _child(_turns, outcome).inc()
+    if outcome in ("diagnosed", "max_turns"):
+        _session_turns.observe(turn)
+
+
+def cache_lookups(lru_hits: int, redis_hits: int, misses: int):
+    if not enabled:
+        return
+    for result, n in (("lru_hit", lru_hits), ("redis_hit", redis_hits), ("miss", misses)):
+        if n:
+            _child(_cache_lookups, result).inc(n)
+
+
+def duplicate(result: str):
+    if not enabled:
+        return
+    _child(_duplicates, result).inc()
+
+
+def export() -> tuple[bytes, str]:
+    """生成 Prometheus 文本格式；多进程模式下汇总 PROMETHEUS_MULTIPROC_DIR 中所有 worker 的数据"""
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,13 +1,32 @@
 from neo4j import GraphDatabase
 from app.config import settings
-from app.services.redis_service import r
+from app.services import call_stats, metrics
+from app.services.kg_csv import KG_DIR, kg_stamp, load_kg
+from app.services.redis_service import (
+    acquire_preload_lock, has_disease_table, is_disease_table_fresh, publish_disease_table,
+    release_preload_lock, stage_diseases, wait_preload_lock,
+)
+import hashlib
 import json
+import logging
 
-driver = GraphDatabase.driver(
-    settings.neo4j_uri,
-    auth=(settings.neo4j_user, settings.neo4j_password),
-    max_connection_pool_size=20,
-)
+logger = logging.getLogger(__name__)
+
+PRELOAD_BATCH_SIZE = 500  # 每批 pipelined HSET 的疾病条数
+PRELOAD_WAIT_ROUNDS = 3  # 等待其他 worker 预加载、其未写入知识表时重新竞争锁的轮数
+
+# 驱动在首次使用时创建，导入本模块不建立连接
+driver = None
+
+def _get_driver():
+    global driver
+    if driver is None:
+        driver = GraphDatabase.driver(
+            settings.neo4j_uri,
+            auth=(settings.neo4j_user, settings.neo4j_password),
+            max_connection_pool_size=20,
+        )
+    return driver
 
 def query_graph(tx, symptom: str):
     cypher = """
@@ -17,70 +36,108 @@ def query_graph(tx, symptom: str):
     """
     return tx.run(cypher, symptom=symptom).data()
 
+@metrics.timed("neo4j_query")
 def get_diseases_by_symptom(symptom: str):
-    with driver.session() as session:
+    call_stats.count("neo4j")
+    with _get_driver().session() as session:
         return session.execute_read(query_graph, symptom)
 
-def preload_diseases_with_symptoms():
-    cypher_query = """
-    MATCH (d:Disease)-[:RELATION]->(f:Feature)
-    RETURN d.diseaseID AS disease_id, d.diseaseName AS disease_name, collect(f.featureName) AS symptoms
-    """
-    with driver.session() as session:
-        result = session.run(cypher_query)
-        for record in result:
-            disease_id = record["disease_id"]
-            disease_name = record["disease_name"]
-            symptoms = record["symptoms"]
-            r.hset("disease_symptoms", disease_id, json.dumps({"disease_name": disease_name, "symptoms": symptoms}))
+# 图谱戳：对知识表依赖的全部内容（疾病 ID / 名称、症状名、groupType）逐行取摘要，
+# 改名、改 groupType、把关系换到另一个症状上等数量不变的修改也会改变戳。
+# Cypher 没有内置哈希函数（不依赖 APOC），由服务端流式返回各行、在本地计算；只读四个属性，比预加载本身轻得多。
+# 图谱为空时没有任何行，得到的是空内容的摘要，由预加载中的空图谱处理接手。
+GRAPH_STAMP_QUERY = """
+MATCH (d:Disease)-[rel:RELATION]->(f:Feature)
+RETURN d.diseaseID AS disease_id, d.diseaseName AS disease_name, f.featureName AS feature, rel.groupType AS group_type
+"""
 
-from neo4j import GraphDatabase
-from app.config import settings
-from app.services.redis_service import r
-import json
+# 症状与 groupType 成对收集：collect() 会丢弃 null，分开收集时缺少 groupType 的关系会让之后的类型错位到别的症状上
+PRELOAD_QUERY = """
+MATCH (d:Disease)-[rel:RELATION]->(f:Feature)
+RETURN d.diseaseID AS disease_id, d.diseaseName AS disease_name,
+       collect([f.featureName, rel.groupType]) AS pairs
+"""
 
-driver = GraphDatabase.driver(
-    settings.neo4j_uri,
-    auth=(settings.neo4j_user, settings.neo4j_password),
-    max_connection_pool_size=20,
-)
+def get_graph_stamp() -> str:
+    if settings.graph_source == "csv":
+        return kg_stamp(settings.graph_csv_dir or KG_DIR)
+    call_stats.count("neo4j")
+    digests = []
+    with _get_driver().session() as session:
+        for record in session.run(GRAPH_STAMP_QUERY):
+            row = [record["disease_id"], record["disease_name"], record["feature"], record["group_type"]]
+            digests.append(hashlib.sha1(json.dumps(row, ensure_ascii=False).encode("utf-8")).digest())
+    # 按行摘要排序后再合并，与返回顺序无关
+    return f"neo4j:{hashlib.sha1(b''.join(sorted(digests))).hexdigest()[:16]}:{len(digests)}"
 
-def query_graph(tx, symptom: str):
-    cypher = """
-    MATCH (s:Symptom {name: $symptom})-[:INDICATES]->(d:Disease)
-    RETURN d.name AS disease
-    LIMIT 5
-    """
-    return tx.run(cypher, symptom=symptom).data()
-
-def get_diseases_by_symptom(symptom: str):
-    with driver.session() as session:
-        return session.execute_read(query_graph, symptom)
+def _graph_records():
+    """逐条产出疾病记录：默认来自 Neo4j（流式读取）；GRAPH_SOURCE=csv 时来自导入用的 CSV（本地替身）"""
+    if settings.graph_source == "csv":
+        for disease_id, record in load_kg(settings.graph_csv_dir or KG_DIR).items():
+            yield {"disease_id": disease_id, **record}
+        return
+    call_stats.count("neo4j")
+    with _get_driver().session() as session:
+        for record in session.run(PRELOAD_QUERY):
+            pairs = record["pairs"]
+            yield {
+                "disease_id": record["disease_id"],
+                "disease_name": record["disease_name"],
+                "symptoms": [name for name, _ in pairs],
+                "group_types": [group_type for _, group_type in pairs],
+            }
 
-def preload_diseases_with_symptoms():
-    cypher_query = """
-    MATCH (d:Disease)-[:RELATION]->(f:Feature)
-    RETURN d.diseaseID AS disease_id, d.diseaseName AS disease_name, collect(f.featureName) AS symptoms
+@metrics.timed("neo4j_preload")
+def preload_diseases_with_symptoms(force: bool = False):
     """
-    with driver.session() as session:
-        result = session.run(cypher_query)
-        for record in result:
+    把疾病-症状表预加载到 Redis。多个 worker 同时启动时只有拿到锁的一个执行，
+    其余等待其完成，锁释放后 Redis 中仍没有知识表（持锁者失败）则重新竞争锁；图谱戳未变且 Redis 中已有数据时直接跳过。
+    结果以流式方式分批写入临时 key，最后 RENAME 原子替换，读者不会看到写了一半的表。
+    """
+    for _ in range(PRELOAD_WAIT_ROUNDS):
+        token = acquire_preload_lock(settings.preload_lock_ttl * 1000)
+        if token is not None:
+            break
+        logger.info("其他 worker 正在预加载疾病知识表，等待其完成")
+        if not wait_preload_lock(settings.preload_lock_ttl):
+            logger.warning("等待预加载超时")
+        # 持锁者可能失败（如 Neo4j 查询出错），等到锁释放不代表知识表已就绪：没有表则重新竞争锁自己加载
+        if has_disease_table():
+            return
+        logger.warning("持锁的 worker 未写入疾病知识表，重新尝试预加载")
+    else:
+        raise RuntimeError(f"等待其他 worker 预加载 {PRELOAD_WAIT_ROUNDS} 轮后 Redis 中仍没有疾病知识表")
+    try:
+        graph_stamp = get_graph_stamp()
+        if not force and is_disease_table_fresh(graph_stamp):
+            logger.info(f"图谱未变化（{graph_stamp}），跳过预加载")
+            return
+
+        staging_key = f"disease_symptoms:staging:{token}"
+        digests = []
+        batch = {}
+        for record in _graph_records():
             disease_id = record["disease_id"]
-            disease_name = record["disease_name"]
-            symptoms = record["symptoms"]
-            r.hset("disease_symptoms", disease_id, json.dumps({"disease_name": disease_name, "symptoms": symptoms}))
+            value = {
+                "disease_name": record["disease_name"],
+                "symptoms": record["symptoms"],
+                "group_types": record["group_types"],
+            }
+            batch[disease_id] = value
+            digests.append(hashlib.sha1(f"{disease_id}={json.dumps(value)}".encode("utf-8")).hexdigest())
+            if len(batch) >= PRELOAD_BATCH_SIZE:
+                stage_diseases(staging_key, batch, settings.preload_lock_ttl)
+                batch = {}
+        stage_diseases(staging_key, batch, settings.preload_lock_ttl)
+        if not digests:
+            if not has_disease_table():
+                raise RuntimeError("图谱中没有疾病-症状关系，Redis 中也没有现有的疾病知识表")
+            logger.warning("图谱中没有疾病-症状关系，保留 Redis 中现有的疾病知识表")
+            return
 
-def get_suggested_symptoms(disease_ids: list, existing_symptoms: list):
-    """
-    根据疾病 ID 和已有症状，推荐其他可能相关的症状。
-    """
-    cypher_query = """
-    MATCH (d:Disease)-[:RELATION]->(f:Feature)
-    WHERE d.diseaseID IN $disease_ids AND NOT (f.featureName IN $existing_symptoms)
-    RETURN DISTINCT f.featureName AS symptom
-    LIMIT 5
-    """
-    with driver.session() as session:
-        result = session.run(cypher_query, disease_ids=disease_ids, existing_symptoms=existing_symptoms)
-        suggested_symptoms = [record["symptom"] for record in result]
-        return suggested_symptoms
+        # 版本戳：图谱内容不变则版本不变（与返回顺序无关）；变化时递增代号并通知所有 worker 热切换快照
+        version = hashlib.sha1("".join(sorted(digests)).encode("utf-8")).hexdigest()
+        generation = publish_disease_table(staging_key, version, graph_stamp, settings.preload_stamp_ttl)
+        logger.info(f"已预加载 {len(digests)} 个疾病到 Redis，图谱戳 {graph_stamp}，代号 {generation or '未变化'}")
+    finally:
+        release_preload_lock(token)
@@ -0,0 +1,129 @@
+# app/services/norm_cache.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from app.config import settings
+from app.services import metrics, redis_async
+from app.services.redis_service import r
+
+
+class NormCache:
+    """
+    症状标准化结果的两级缓存：进程内有界 LRU + Redis 共享缓存（所有 worker 共用）。
+    key 为原始文本，value 为可 JSON 序列化的检索结果（如 top-k 候选 [[症状, 相似度], ...]）；
+    namespace 取向量文件的内容哈希，向量重新生成后旧缓存自然失效。
+    Redis 中每条一个 key（symptom_norm:{namespace}:{文本摘要}），各自 SET EX 过期：原始实体文本种类无上限，
+    不常出现的条目到期即被回收，共享缓存的内存只取决于 TTL 窗口内的不同文本数，不随运行时间增长。
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl: int):
+        self.redis_key = f"symptom_norm:{namespace}"
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.lru_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def get_many(self, texts: list[str], fill: bool = True) -> dict:
+        """
+        返回命中的 {text: value}，未命中的不在结果中。
+        fill=False 时只读：不调整 LRU 顺序，Redis 命中的条目也不放入 LRU（批量诊断的一次性文本不挤掉交互请求的热点条目）。
+        """
+        found, remote = self._get_local(texts, fill)
+        raws = []
+        if remote:
+            with metrics.timer("redis_norm_cache_get"):
+                raws = r.mget([self._key(text) for text in remote])
+        return self._merge_remote(texts, found, remote, raws, fill)
+
+    async def get_many_async(self, texts: list[str]) -> dict:
+        """get_many 的异步版本（异步诊断接口），Redis 读取不占用线程"""
+        found, remote = self._get_local(texts)
+        raws = []
+        if remote:
+            with metrics.timer("redis_norm_cache_get"):
+                raws = await redis_async.r.mget([self._key(text) for text in remote])
+        return self._merge_remote(texts, found, remote, raws)
+
+    def _get_local(self, texts: list[str], fill: bool = True) -> tuple[dict, list[str]]:
+        found = {}
+        with self._lock:
+            for text in texts:
+                if text in self._lru:
+                    if fill:
+                        self._lru.move_to_end(text)
+                    found[text] = self._lru[text]
+            self.lru_hits += len(found)
+        return found, [text for text in texts if text not in found]
+
+    def _merge_remote(self, texts: list[str], found: dict, remote: list[str], raws: list, fill: bool = True) -> dict:
+        hits = 0
+        for text, raw in zip(remote, raws):
+            if raw is not None:
+                found[text] = json.loads(raw)
+                hits += 1
+        if remote:
+            with self._lock:
+                self.redis_hits += hits
+                self.misses += len(remote) - hits
+                for text in remote:
+                    if fill and text in found:
+                        self._put_local(text, found[text])
+        metrics.cache_lookups(len(texts) - len(remote), hits, len(remote) - hits)
+        return found
+
+    def put_many(self, items: dict):
+        if not items:
+            return
+        with self._lock:
+            for text, value in items.items():
+                self._put_local(text, value)
+        pipe = self._set_pipeline(r, items)
+        with metrics.timer("redis_norm_cache_put"):
+            pipe.execute()
+
+    async def put_many_async(self, items: dict):
+        if not items:
+            return
+        with self._lock:
+            for text, value in items.items():
+                self._put_local(text, value)
+        pipe = self._set_pipeline(redis_async.r, items)
+        with metrics.timer("redis_norm_cache_put"):
+            await pipe.execute()
+
+    def _set_pipeline(self, client, items: dict):
+        pipe = client.pipeline(transaction=False)
+        for text, value in items.items():
+            pipe.set(self._key(text), json.dumps(value, ensure_ascii=False), ex=self.ttl)
+        return pipe
+
+    def _key(self, text: str) -> str:
+        # 用摘要而非原文作 key：原始文本长度不受控
+        return f"{self.redis_key}:{hashlib.sha1(text.encode('utf-8')).hexdigest()[:20]}"
+
+    def _put_local(self, text: str, value):
+        self._lru[text] = value
+        self._lru.move_to_end(text)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.lru_hits + self.redis_hits + self.misses
+            return {
+                "namespace": self.redis_key,
+                "size": len(self._lru),
+                "maxsize": self.maxsize,
+                "lru_hits": self.lru_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": (self.lru_hits + self.redis_hits) / lookups if lookups else 0.0,
+            }
+
+
+def create_cache(namespace: str) -> NormCache:
+    return NormCache(namespace, settings.norm_cache_size, settings.norm_cache_ttl)
@@ -0,0 +1,189 @@
+"""
+m3e-small 的 ONNX 推理后端：导出 Transformer 主干为 ONNX（可选 int8 动态量化），
+用 onnxruntime 在 CPU 上推理，池化与归一化在 NumPy 中完成，接口与 SentenceTransformer.encode 兼容。
+
+依赖（可选）：pip install onnxruntime transformers；导出时还需要 torch、onnx。
+
+用法（在 middleware 目录下）：
+    python -m app.services.onnx_encoder export                 # 导出 fp32 + int8 模型到 app/services/onnx_model
+    python -m app.services.onnx_encoder check                  # 与 PyTorch 后端对比 feature.csv 全量（原名 + 口语化改写）top-1 一致率
+    python -m app.services.onnx_encoder check --fp32           # 对比未量化的 ONNX 模型
+
+启用：ENCODER_BACKEND=onnx（ONNX_QUANTIZED=false 使用 fp32 模型）。
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+from pathlib import Path
+
+MODEL_DIR = Path(__file__).with_name("onnx_model")
+CONFIG_NAME = "onnx_config.json"
+FP32_NAME = "model.onnx"
+INT8_NAME = "model.int8.onnx"
+
+
+def backend_tag(backend: str, quantized: bool = True) -> str:
+    """编码后端标识（torch / onnx-int8 / onnx-fp32）：写入向量存储头信息，并作为标准化缓存命名空间的一部分，
+    不同后端编码的向量不混用、检索结果不共享"""
+    if backend == "onnx":
+        return "onnx-int8" if quantized else "onnx-fp32"
+    return "torch"
+
+
+def export(model_name: str, out_dir: Path = MODEL_DIR, quantize: bool = True, opset: int = 14) -> dict:
+    """从 SentenceTransformer 导出 Transformer 主干，并保存分词器与池化配置"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = st[0], st[1]
+    tokenizer = transformer.tokenizer
+    auto_model = transformer.auto_model.eval()
+
+    dummy = tokenizer(["咳嗽", "鸡冠及肉垂肿胀"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+
+    class _Backbone(torch.nn.Module):
+        def forward(self, *inputs):
+            return auto_model(**dict(zip(input_names, inputs)), return_dict=True).last_hidden_state
+
+    dynamic_axes = {name: {0: "batch", 1: "seq"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(
+            _Backbone(), tuple(dummy[name] for name in input_names), str(out_dir / FP32_NAME),
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=opset,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(out_dir / FP32_NAME), str(out_dir / INT8_NAME), weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(str(out_dir))
+    config = {
+        "model": model_name,
+        "inputs": input_names,
+        "pooling": pooling.get_pooling_mode_str(),
+        "max_seq_length": st.max_seq_length,
+        "quantized": quantize,
+    }
+    (out_dir / CONFIG_NAME).write_text(json.dumps(config, ensure_ascii=False, indent=2), encoding="utf-8")
+    return config
+
+
+class OnnxEncoder:
+    """onnxruntime CPU 推理；encode 的参数与返回值同 SentenceTransformer.encode（numpy 输出）"""
+
+    def __init__(self, model_dir: Path = MODEL_DIR, quantized: bool = True, threads: int = 0):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise RuntimeError("ONNX 编码后端需要安装 onnxruntime 与 transformers：pip install onnxruntime transformers") from e
+        model_dir = Path(model_dir)
+        self.config = json.loads((model_dir / CONFIG_NAME).read_text(encoding="utf-8"))
+        if self.config["pooling"] not in ("mean", "cls"):
+            raise ValueError(f"不支持的池化方式: {self.config['pooling']}")
+        model_file = model_dir / (INT8_NAME if quantized else FP32_NAME)
+        if not model_file.exists():
+            raise FileNotFoundError(f"未找到 ONNX 模型 {model_file}，请先运行 python -m app.services.onnx_encoder export")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.inputs = self.config["inputs"]
+        self.model_file = model_file
+
+    def _forward(self, texts: list[str]) -> np.ndarray:
+        enc = self.tokenizer(texts, padding=True, truncation=True,
+                             max_length=self.config["max_seq_length"], return_tensors="np")
+        feeds = {name: enc.get(name, np.zeros_like(enc["input_ids"])).astype(np.int64) for name in self.inputs}
+        hidden = self.session.run(None, feeds)[0]
+        if self.config["pooling"] == "cls":
+            return hidden[:, 0]
+        mask = enc["attention_mask"][..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts: list[str], normalize_embeddings: bool = False, batch_size: int = 32, **_) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        vecs = np.vstack([self._forward(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+        vecs = vecs.astype(np.float32)
+        if normalize_embeddings:
+            vecs /= np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        return vecs
+
+
+def _timed_encode(model, texts: list[str]) -> tuple[np.ndarray, float]:
+    """逐条编码（模拟在线单请求），返回向量与平均单条耗时（毫秒）"""
+    vecs, t0 = [], time.perf_counter()
+    for text in texts:
+        vecs.append(model.encode([text], normalize_embeddings=True)[0])
+    return np.vstack(vecs).astype(np.float32), (time.perf_counter() - t0) * 1000 / max(len(texts), 1)
+
+
+def check(csv_path: Path, model_dir: Path = MODEL_DIR, quantized: bool = True):
+    """
+    对 feature.csv 中的每个特征名及其口语化改写（bench_diagnosis.PARAPHRASES），分别用 PyTorch 与 ONNX 后端
+    编码后在向量存储中检索 top-1，统计两者一致的比例、向量余弦相似度以及单条编码延迟。
+    原名在知识库中有完全相同的条目，两个后端几乎必然一致；改写后的查询才反映量化对真实输入的影响。
+    """
+    import pandas as pd
+    from sentence_transformers import SentenceTransformer
+    from app.services.bench_diagnosis import PARAPHRASES
+    from app.services.vector_store import HEADER_PATH, load_store
+
+    store = load_store(HEADER_PATH)
+    kb = store.float_vecs()
+    exact = pd.read_csv(csv_path)["featureName"].astype(str).tolist()
+    paraphrased = [PARAPHRASES[i % len(PARAPHRASES)].format(name) for i, name in enumerate(exact)]
+    names = exact + paraphrased
+
+    torch_vecs, torch_ms = _timed_encode(SentenceTransformer(store.model, device="cpu"), names)
+    onnx_model = OnnxEncoder(model_dir, quantized)
+    onnx_vecs, onnx_ms = _timed_encode(onnx_model, names)
+
+    torch_top1 = np.argmax(torch_vecs @ kb.T, axis=1)
+    onnx_top1 = np.argmax(onnx_vecs @ kb.T, axis=1)
+    cosine = np.sum(torch_vecs * onnx_vecs, axis=1)
+    mismatches = [(names[i], store.names[torch_top1[i]], store.names[onnx_top1[i]])
+                  for i in np.flatnonzero(torch_top1 != onnx_top1)]
+
+    print(f"ONNX 模型：{onnx_model.model_file}（{os.path.getsize(onnx_model.model_file) / 2**20:.1f} MB）")
+    agree = torch_top1 == onnx_top1
+    print(f"特征数：{len(exact)}，top-1 一致率：原名 {agree[:len(exact)].mean():.4f}，改写 {agree[len(exact):].mean():.4f}")
+    print(f"向量余弦相似度：平均 {cosine.mean():.4f}，最小 {cosine.min():.4f}")
+    print(f"单条编码耗时：PyTorch {torch_ms:.2f}ms，ONNX {onnx_ms:.2f}ms")
+    for raw, expected, got in mismatches[:20]:
+        print(f"  不一致：{raw} -> PyTorch {expected} / ONNX {got}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="导出 ONNX 模型（默认同时生成 int8 量化版本）")
+    exp.add_argument("--model", default="moka-ai/m3e-small")
+    exp.add_argument("--out", default=str(MODEL_DIR))
+    exp.add_argument("--no-quantize", action="store_true")
+    chk = sub.add_parser("check", help="与 PyTorch 后端对比 top-1 匹配（原名与口语化改写）")
+    chk.add_argument("--csv", default="../pre-process/KG/import_data/feature.csv")
+    chk.add_argument("--model-dir", default=str(MODEL_DIR))
+    chk.add_argument("--fp32", action="store_true", help="对比未量化的模型")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        config = export(args.model, Path(args.out), not args.no_quantize)
+        print(f"已导出 {config['model']} 到 {args.out}（池化 {config['pooling']}，int8：{config['quantized']}）")
+    else:
+        check(Path(args.csv), Path(args.model_dir), not args.fp32)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# app/services/question_selector.py
+# 追问症状选择：在内存中的疾病-症状矩阵上，按信息增益挑选最能区分当前候选疾病的症状
+import numpy as np
+
+DIFFERENT_BONUS = 0.5   # 对候选疾病而言属于鉴别性症状（groupType 为 different）时的加权
+SIMILAR_PENALTY = 0.3   # 属于同组疾病共有症状（groupType 为 similar）时的降权：同组的候选疾病都有，答案难以区分它们
+
+
+def _posterior(scores: np.ndarray) -> np.ndarray:
+    """把 BM25 得分换算为候选疾病的概率分布（softmax）；尚无症状时为均匀分布"""
+    weights = np.exp(scores - scores.max())
+    return weights / weights.sum()
+
+
+def information_gain(index, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    返回每个症状的 (信息增益, 鉴别性比例, 共有症状比例)。
+    把“是否有该症状”看作对候选疾病的一次划分，期望熵减等于回答的二元熵 H(q)，
+    q 为按当前概率分布计算的“有该症状”的概率；q 越接近 0.5，问这个症状越能把候选疾病一分为二。
+    """
+    p = _posterior(np.asarray(scores, dtype=np.float64))
+    presence = index.presence.T @ p  # q：有该症状的概率（用 0/1 矩阵，重复的疾病-症状关系不重复计入）
+    q = np.clip(presence, 1e-12, 1 - 1e-12)
+    gain = -(q * np.log2(q) + (1 - q) * np.log2(1 - q))
+    gain[presence <= 1e-12] = 0.0
+    # 按“有该症状”的候选疾病的概率加权，该症状在这些疾病中被标为 different / similar 的比例
+    different = np.divide(index.different.T @ p, presence, out=np.zeros_like(presence), where=presence > 1e-12)
+    similar = np.divide(index.similar.T @ p, presence, out=np.zeros_like(presence), where=presence > 1e-12)
+    return gain, different, similar
+
+
+def select(index, scores: np.ndarray, exclude, k: int = 5) -> list[str]:
+    """挑选 k 个最值得追问的症状（跳过已有和已问过的症状）"""
+    if not index.terms:
+        return []
+    gain, different, similar = information_gain(index, scores)
+    value = gain * (1 + DIFFERENT_BONUS * different - SIMILAR_PENALTY * similar)
+    excluded = [index.vocab[term] for term in exclude if term in index.vocab]
+    value[excluded] = -1.0
+
+    order = np.argsort(-value, kind="stable")[:k]
+    chosen = [index.terms[col] for col in order if value[col] > 1e-9]
+    if chosen:
+        return chosen
+
+    # 候选已收敛到一个疾病（没有能再区分的症状）：追问得分最高疾病尚未提及的症状，鉴别性症状优先、共有症状最后
+    top = int(np.argmax(scores))
+    row = index.presence[top]
+    marks = index.different[top].toarray().ravel() - index.similar[top].toarray().ravel()
+    cols = sorted((col for col in row.indices if value[col] > -1.0), key=lambda col: -marks[col])
+    return [index.terms[col] for col in cols[:k]]
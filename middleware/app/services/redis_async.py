@@ -0,0 +1,33 @@
+# app/services/redis_async.py
+# redis_service 的异步版本（redis.asyncio），供 DIAGNOSE_MODE=async 的诊断接口使用；
+# 症状 ID 与名称的互转共用 symptom_ids 的进程内映射（由向量存储表得出，不访问 Redis）
+import redis.asyncio as aioredis
+from app.config import settings
+from app.services import metrics
+from app.services.redis_service import (
+    _BEGIN_TURN_LUA, _begin_turn_args, _expire_session, _key, _symptom_key, _decode_session, _encode_fields, _public,
+    _turn_result,
+)
+
+r = aioredis.from_url(settings.redis_url, decode_responses=True)
+_begin_turn_script = r.register_script(_BEGIN_TURN_LUA)
+
+async def set_session(uid: str, sid: str, **fields):
+    if fields:
+        await r.hset(_key(uid, sid), mapping=_encode_fields(fields))
+
+@metrics.timed("redis_begin_turn")
+async def begin_turn(uid: str, sid: str, symptoms: list[str] = (), retracted: list[str] = ()) -> tuple[dict, int, list, list]:
+    return _turn_result(await _begin_turn_script(
+        keys=[_key(uid, sid), _symptom_key(uid, sid)], args=_begin_turn_args(list(symptoms), retracted, settings.session_ttl)))
+
+@metrics.timed("redis_commit_turn")
+async def commit_turn(uid: str, sid: str, state: dict, finished: bool = False, **fields) -> dict:
+    if finished:
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(_key(uid, sid), mapping=_encode_fields(fields))
+        _expire_session(pipe, uid, sid, settings.session_finished_ttl)
+        await pipe.execute()
+    else:
+        await set_session(uid, sid, **fields)
+    return _public({**state, **_decode_session(_encode_fields(fields))})
@@ -1,13 +1,83 @@
-import redis, json
+import redis, json, time, uuid
 from app.config import settings
+from app.services import metrics, symptom_ids
 
 r = redis.from_url(settings.redis_url, decode_responses=True)
 
 def _key(uid: str, sid: str) -> str:
     return f"{uid}:{sid}"
 
-def get_session(uid: str, sid: str) -> dict:
-    data = r.hgetall(_key(uid, sid)) or {}
+def _symptom_key(uid: str, sid: str) -> str:
+    # 会话已确认症状存为 Redis 原生 set，并发的两轮对话各自 SADD，不会互相覆盖
+    return f"{uid}:{sid}:symptoms"
+
+# 开始一轮对话：自增轮次、把旧版 JSON 列表字段 entities 迁移进 set、
+# 原子地加入本轮症状并移除用户撤回的症状、刷新会话的滑动过期时间，
+# 返回 [轮次, 会话 hash, 当前症状集合, 实际新增的症状, 实际移除的症状]。
+# ARGV[1] 为过期时间（秒，0 表示不过期），ARGV[2] 为本轮新增症状个数 n，ARGV[3..n+2] 为新增症状，其余为撤回的症状；
+# 症状集合中存的是症状 ID（见 symptom_ids），旧会话中可能还有症状名
+_BEGIN_TURN_LUA = """
+local turn = redis.call('HINCRBY', KEYS[1], 'turn', 1)
+local legacy = redis.call('HGET', KEYS[1], 'entities')
+if legacy then
+    local ok, list = pcall(cjson.decode, legacy)
+    if ok and type(list) == 'table' then
+        for _, v in ipairs(list) do redis.call('SADD', KEYS[2], v) end
+    end
+    redis.call('HDEL', KEYS[1], 'entities')
+end
+local ttl = tonumber(ARGV[1]) or 0
+local n = tonumber(ARGV[2]) or 0
+local added, removed = {}, {}
+for i = 3, n + 2 do
+    if redis.call('SADD', KEYS[2], ARGV[i]) == 1 then added[#added + 1] = ARGV[i] end
+end
+for i = n + 3, #ARGV do
+    if redis.call('SREM', KEYS[2], ARGV[i]) == 1 then removed[#removed + 1] = ARGV[i] end
+end
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[2], ttl)
+end
+return {turn, redis.call('HGETALL', KEYS[1]), redis.call('SMEMBERS', KEYS[2]), added, removed}
+"""
+_begin_turn_script = r.register_script(_BEGIN_TURN_LUA)
+
+# 仅供服务端使用的会话字段（如打包的疾病得分），不随 session_state 返回给调用方
+_INTERNAL_FIELDS = ("score_state",)
+# 以症状 ID 列表存储的会话字段，读写时与症状名互转
+_SYMPTOM_FIELDS = ("asked",)
+
+def _begin_turn_args(symptoms, retracted, ttl: int) -> list:
+    retracted = [s for s in dict.fromkeys(retracted) if s not in symptoms]  # 同一轮既新增又撤回的以新增为准
+    # 撤回时同时按 ID 和症状名移除，兼容改用 ID 编码之前写入的旧会话
+    return [ttl, len(symptoms), *symptom_ids.encode(symptoms), *symptom_ids.encode(retracted), *retracted]
+
+def _turn_result(result) -> tuple[dict, int, list, list]:
+    turn, data, members, added, removed = result
+    return (_with_symptoms(_pairs(data), members), turn,
+            symptom_ids.decode(added), list(dict.fromkeys(symptom_ids.decode(removed))))
+
+def _expire_session(pipe, uid: str, sid: str, ttl: int):
+    """在 pipeline 中设置会话 hash 与症状 set 的过期时间（ttl 为 0 时不变）"""
+    if ttl > 0:
+        pipe.expire(_key(uid, sid), ttl)
+        pipe.expire(_symptom_key(uid, sid), ttl)
+
+def _public(state: dict) -> dict:
+    return {k: v for k, v in state.items() if k not in _INTERNAL_FIELDS}
+
+def _pairs(flat: list) -> dict:
+    return dict(zip(flat[::2], flat[1::2]))
+
+def _with_symptoms(data: dict, symptoms) -> dict:
+    """解码会话 hash，并把症状 set 合并为 entities 列表（兼容尚未迁移的旧 JSON 字段）"""
+    state = _decode_session(data or {})
+    if symptoms:
+        state["entities"] = sorted(set(state.get("entities") or []) | set(symptom_ids.decode(symptoms)))
+    return state
+
+def _decode_session(data: dict) -> dict:
     result = {}
     for k, v in data.items():
         if v == "null":  # 检查是否为字符串 "null"
@@ -17,20 +87,136 @@ def get_session(uid: str, sid: str) -> dict:
                 result[k] = json.loads(v)
             except json.JSONDecodeError:
                 result[k] = v
+            if k in _SYMPTOM_FIELDS and isinstance(result[k], list):
+                result[k] = symptom_ids.decode(result[k])
     return result
 
-def set_session(uid: str, sid: str, **fields):
+def _encode_fields(fields: dict) -> dict:
+    encoded = {}
     for k, v in fields.items():
+        if k in _SYMPTOM_FIELDS and isinstance(v, list):
+            v = symptom_ids.encode(v)
         if v is None:
             v = "null"  # 将 None 转换为字符串 "null"
-        elif isinstance(v, list) or isinstance(v, dict):
-            v = json.dumps(v, ensure_ascii=False)
-        r.hset(_key(uid, sid), k, v)
+        elif isinstance(v, (list, dict, bool)):
+            v = json.dumps(v, ensure_ascii=False)  # bool 存为 "true"/"false"，读取时还原
+        encoded[k] = v
+    return encoded
+
+@metrics.timed("redis_get_session")
+def get_session(uid: str, sid: str) -> dict:
+    pipe = r.pipeline(transaction=True)
+    pipe.hgetall(_key(uid, sid))
+    pipe.smembers(_symptom_key(uid, sid))
+    data, symptoms = pipe.execute()
+    return _with_symptoms(data, symptoms)
+
+def set_session(uid: str, sid: str, **fields):
+    if fields:
+        r.hset(_key(uid, sid), mapping=_encode_fields(fields))
+
+# 会话工作单元：每轮对话只需两次往返 —— begin_turn 读取并自增轮次、合并症状，commit_turn 一次性写回
+@metrics.timed("redis_begin_turn")
+def begin_turn(uid: str, sid: str, symptoms: list[str] = (), retracted: list[str] = ()) -> tuple[dict, int, list, list]:
+    """
+    一个 Lua 脚本内完成：自增轮次、原子加入本轮已确认症状并移除撤回的症状、刷新过期时间、读取会话。
+    返回 (会话状态, 本轮轮次, 实际新增的症状, 实际移除的症状)，会话状态中的 entities 为合并后的全部症状。
+    """
+    return _turn_result(_begin_turn_script(
+        keys=[_key(uid, sid), _symptom_key(uid, sid)], args=_begin_turn_args(list(symptoms), retracted, settings.session_ttl)))
+
+@metrics.timed("redis_commit_turn")
+def commit_turn(uid: str, sid: str, state: dict, finished: bool = False, **fields) -> dict:
+    """
+    一次往返写入本轮所有字段，返回合并后的会话状态（无需再读一次 Redis，不含内部字段）。
+    finished 表示会话已结束（确诊 / 达到最大轮数，内容已归档），过期时间缩短为 SESSION_FINISHED_TTL。
+    """
+    if finished:
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(_key(uid, sid), mapping=_encode_fields(fields))
+        _expire_session(pipe, uid, sid, settings.session_finished_ttl)
+        pipe.execute()
+    else:
+        set_session(uid, sid, **fields)
+    return _public({**state, **_decode_session(_encode_fields(fields))})
+
+# 疾病知识表的分发：disease_symptoms 存全表，version 为内容哈希，generation 为单调递增代号，
+# 内容变化时通过 pub/sub 频道通知所有 worker 热切换内存快照
+DISEASE_KEY = "disease_symptoms"
+DISEASE_VERSION_KEY = "disease_symptoms:version"
+DISEASE_GENERATION_KEY = "disease_symptoms:generation"
+DISEASE_CHANNEL = "disease_symptoms:updates"
+
+def get_disease_generation() -> int:
+    return int(r.get(DISEASE_GENERATION_KEY) or 0)
+
+DISEASE_STAMP_KEY = "disease_symptoms:graph_stamp"
+DISEASE_LOCK_KEY = "disease_symptoms:lock"
+
+# 只有持有者才能释放锁，避免锁过期后误删其他 worker 的锁
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+_release_lock_script = r.register_script(_RELEASE_LOCK_LUA)
+
+def acquire_preload_lock(ttl_ms: int) -> str | None:
+    token = uuid.uuid4().hex
+    return token if r.set(DISEASE_LOCK_KEY, token, nx=True, px=ttl_ms) else None
+
+def release_preload_lock(token: str):
+    _release_lock_script(keys=[DISEASE_LOCK_KEY], args=[token])
+
+def wait_preload_lock(timeout: float, interval: float = 0.2) -> bool:
+    """等待其他 worker 完成预加载（锁被释放或过期），返回是否在超时前等到"""
+    deadline = time.monotonic() + timeout
+    while r.exists(DISEASE_LOCK_KEY):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+def has_disease_table() -> bool:
+    return bool(r.exists(DISEASE_KEY))
+
+def is_disease_table_fresh(graph_stamp: str) -> bool:
+    """Redis 中已有完整知识表且图谱戳未变，则无需重新预加载"""
+    pipe = r.pipeline(transaction=True)
+    pipe.get(DISEASE_STAMP_KEY)
+    pipe.exists(DISEASE_KEY)
+    stamp, exists = pipe.execute()
+    return bool(exists) and stamp == graph_stamp
 
-def incr_turn(uid: str, sid: str) -> int:
-    return r.hincrby(_key(uid, sid), "turn", 1)
+def stage_diseases(staging_key: str, records: dict, ttl: int):
+    """把一批疾病记录以一次 pipelined HSET 写入临时 key（预加载中断时临时 key 自动过期）"""
+    if records:
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(staging_key, mapping={k: json.dumps(v, ensure_ascii=False) for k, v in records.items()})
+        pipe.expire(staging_key, ttl)
+        pipe.execute()
 
-def get_all_disease_symptoms():
-    disease_symptoms = r.hgetall("disease_symptoms")
-    return {k: json.loads(v) for k, v in disease_symptoms.items()}
+def publish_disease_table(staging_key: str, version: str, graph_stamp: str, stamp_ttl: int) -> int | None:
+    """
+    在一个 MULTI 事务里用 RENAME 原子替换知识表并记录版本戳和图谱戳；
+    内容有变化时递增代号并广播，返回新代号，否则返回 None。
+    """
+    changed = r.get(DISEASE_VERSION_KEY) != version
+    pipe = r.pipeline(transaction=True)
+    pipe.rename(staging_key, DISEASE_KEY)
+    pipe.persist(DISEASE_KEY)
+    pipe.set(DISEASE_VERSION_KEY, version)
+    pipe.set(DISEASE_STAMP_KEY, graph_stamp, ex=stamp_ttl)
+    if changed:
+        pipe.incr(DISEASE_GENERATION_KEY)
+        pipe.publish(DISEASE_CHANNEL, "")
+    results = pipe.execute()
+    return results[4] if changed else None
 
+def get_disease_table() -> tuple[int, str | None, dict]:
+    """在同一个事务里读取 (代号, 版本戳, 疾病表)，避免三者不一致"""
+    pipe = r.pipeline(transaction=True)
+    pipe.get(DISEASE_GENERATION_KEY)
+    pipe.get(DISEASE_VERSION_KEY)
+    pipe.hgetall(DISEASE_KEY)
+    generation, version, disease_symptoms = pipe.execute()
+    return int(generation or 0), version, {k: json.loads(v) for k, v in disease_symptoms.items()}
@@ -1,31 +1,119 @@
 # app/services/semantic.py
-import pickle
-import numpy as np
-from pathlib import Path
-from sentence_transformers import SentenceTransformer
+import threading
+from app.config import settings
+from app.services import encoder, metrics
+from app.services.norm_cache import create_cache
+from app.services.vector_index import create_index
+from app.services.vector_store import HEADER_PATH, load_store
 
-VEC_PATH   = Path(__file__).with_name("feature_vec.pkl")
 SIM_THRESH = 0.7
+CANDIDATE_K = 3          # 每个实体保留的候选数
+CANDIDATE_THRESH = 0.5   # 澄清时给出“您是指 X 还是 Y”候选的最低相似度
 
-# 启动时一次性加载
-with open(VEC_PATH, "rb") as f:
-    data = pickle.load(f)
-KB_IDS, KB_NAMES, KB_VECS = data["ids"], data["names"], np.array(data["vecs"])
+# 向量存储与检索索引按需加载（导入本模块不做任何 I/O），编码器见 encoder.py；
+# 由启动编排器在后台并发预热，未预热时首个请求触发加载
+_lock = threading.Lock()
+STORE = None
+VEC_HASH = None  # 向量存储校验和，作为缓存命名空间
+_index = None
+_cache = None
 
-# 轻量级在线编码器
-_model = None
-def _get_model():
-    global _model
-    if _model is None:
-        _model = SentenceTransformer("moka-ai/m3e-small")
-    return _model
+def load():
+    """以 memmap 方式打开向量存储（多个 worker 共享同一份物理内存），并建立检索索引与结果缓存"""
+    global STORE, VEC_HASH, _index, _cache
+    with _lock:
+        if STORE is None:
+            store = load_store(HEADER_PATH)
+            # 查询向量与存储向量必须由同一编码后端生成，否则相似度没有意义（ONNX int8 与 torch 的向量并不相同）
+            if store.backend != encoder.backend():
+                raise ValueError(
+                    f"向量存储由编码后端 {store.backend} 生成，与当前配置的 {encoder.backend()} 不一致；"
+                    f"请用 build_feature_vec.py --backend 重新生成向量存储，或调整 ENCODER_BACKEND / ONNX_QUANTIZED")
+            VEC_HASH = store.checksum[:16]
+            # 向量检索索引：exact（NumPy 全量内积）或 hnsw（近似最近邻）
+            _index = create_index(store, settings.vector_index_backend)
+            # 检索结果缓存（进程内 LRU + Redis），向量文件重新生成或切换编码后端后自动失效
+            _cache = create_cache(f"{VEC_HASH}:{encoder.backend()}:k{CANDIDATE_K}")
+            STORE = store
+    return STORE
 
 def normalize_symptom(raw: str) -> tuple[str, float] | None:
-    raw = raw.strip()
-    if not raw:
-        return None
-    vec = _get_model().encode([raw], normalize_embeddings=True)
-    sims = np.dot(KB_VECS, vec.T).flatten()
-    idx = int(np.argmax(sims))
-    score = float(sims[idx])
-    return (KB_NAMES[idx], score) if score >= SIM_THRESH else None
\ No newline at end of file
+    return normalize_symptoms([raw])[0]
+
+@metrics.timed("normalize")
+def normalize_symptoms(raws: list[str], fill: bool = True) -> list[tuple[str, float] | None]:
+    """
+    批量标准化：返回与 raws 一一对应的 (标准症状, 相似度)，未达阈值或为空的实体为 None。
+    fill=False 时只读缓存，新结果不写入任何一级缓存（见 search_symptoms）。
+    """
+    return _best(search_symptoms(raws, fill=fill))
+
+@metrics.timed("normalize")
+async def normalize_symptoms_async(raws: list[str], offload) -> list[tuple[str, float] | None]:
+    """异步版本：缓存读写走异步 Redis，编码与检索由 offload(func, *args) 放到线程池执行"""
+    return _best(await search_symptoms_async(raws, offload))
+
+def _best(candidate_lists) -> list[tuple[str, float] | None]:
+    results = []
+    for candidates in candidate_lists:
+        best = candidates[0] if candidates else None
+        results.append(best if best and best[1] >= SIM_THRESH else None)
+    return results
+
+def search_symptoms(raws: list[str], k: int = CANDIDATE_K, fill: bool = True) -> list[list[tuple[str, float]]]:
+    """
+    批量检索每个实体的 top-k 候选（相似度从高到低）：先查缓存，
+    未命中的实体一次前向编码，再经向量索引一次批量检索。
+    fill=False 时只读缓存：新结果既不进进程内 LRU 也不写 Redis，命中也不调整 LRU 顺序
+    （批量诊断的历史报告文本大多只出现一次，不应挤掉交互请求的热点条目）。
+    """
+    if STORE is None:
+        load()
+    texts = [raw.strip() for raw in raws]
+    uniq = list(dict.fromkeys(text for text in texts if text))
+    found = _cache.get_many(uniq, fill) if uniq and k <= CANDIDATE_K else {}
+
+    # 只对缓存未命中的文本做编码
+    todo = [text for text in uniq if text not in found]
+    if todo:
+        fresh = _encode_search(todo, k)
+        if fill:
+            _cache.put_many({text: value[:CANDIDATE_K] for text, value in fresh.items()})
+        found.update(fresh)
+    return _candidates(texts, found, k)
+
+async def search_symptoms_async(raws: list[str], offload, k: int = CANDIDATE_K) -> list[list[tuple[str, float]]]:
+    """search_symptoms 的异步版本：缓存未命中时不占用线程等待 Redis，只有编码与检索交给 offload"""
+    if STORE is None:
+        load()
+    texts = [raw.strip() for raw in raws]
+    uniq = list(dict.fromkeys(text for text in texts if text))
+    found = await _cache.get_many_async(uniq) if uniq and k <= CANDIDATE_K else {}
+
+    todo = [text for text in uniq if text not in found]
+    if todo:
+        fresh = await offload(_encode_search, todo, k)
+        await _cache.put_many_async({text: value[:CANDIDATE_K] for text, value in fresh.items()})
+        found.update(fresh)
+    return _candidates(texts, found, k)
+
+def _encode_search(todo: list[str], k: int) -> dict:
+    """一次前向编码 + 一次批量检索，返回 {文本: [[症状, 相似度], ...]}"""
+    with metrics.timer("encode"):
+        vecs = encoder.encode(todo)
+    with metrics.timer("vector_search"):
+        scores, idxs = _index.search(vecs, max(k, CANDIDATE_K))
+    return {
+        text: [[STORE.names[idx], float(score)] for score, idx in zip(row_scores, row_idxs)]
+        for text, row_scores, row_idxs in zip(todo, scores, idxs)
+    }
+
+def _candidates(texts: list[str], found: dict, k: int) -> list[list[tuple[str, float]]]:
+    return [[(name, score) for name, score in found.get(text, [])[:k]] for text in texts]
+
+def suggest_candidates(raw: str) -> list[str]:
+    """澄清用的候选标准症状；刚检索过的实体直接命中缓存，无需再次编码"""
+    return [name for name, score in search_symptoms([raw])[0] if score >= CANDIDATE_THRESH]
+
+def cache_stats() -> dict:
+    return _cache.stats() if _cache is not None else {}
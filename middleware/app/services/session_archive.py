@@ -0,0 +1,27 @@
+# app/services/session_archive.py
+# 已结束会话（确诊 / 达到最大轮数）的归档：每个会话追加一行紧凑 JSON 到本地文件（SESSION_ARCHIVE_FILE），
+# 经日志队列由后台线程写盘。归档后 Redis 中的会话只保留 SESSION_FINISHED_TTL，Redis 内存不随时间增长。
+# 归档中的症状用标准症状名而非 ID，文件脱离 Redis 也能独立阅读；同一会话结束后又继续问诊会再追加一行，以最后一行为准。
+import json
+import time
+from app.config import settings
+from app.services import log_setup
+
+_logger = None
+
+
+def archive(uid: str, sid: str, turn: int, outcome: str, symptoms: list[str], diseases: list[str]):
+    global _logger
+    if not settings.session_archive_file:
+        return
+    if _logger is None:
+        _logger = log_setup.file_logger("app.session_archive", settings.session_archive_file)
+    _logger.info("%s", json.dumps({
+        "ts": int(time.time()),
+        "user_id": uid,
+        "session_id": sid,
+        "turn": turn,
+        "outcome": outcome,  # diagnosed / max_turns
+        "diseases": diseases,
+        "symptoms": symptoms,
+    }, ensure_ascii=False, separators=(",", ":")))
@@ -0,0 +1,136 @@
+"""
+Redis 会话内存报告：统计会话 key（{uid}:{sid} hash 与 {uid}:{sid}:symptoms set）的数量、占用字节、
+过期时间分布，以及抽样会话中各字段的平均大小，用于确认会话内存随时间保持平稳。
+
+用法（在 middleware 目录下）：
+    python -m app.services.session_report
+    python -m app.services.session_report --expire-legacy   # 给没有过期时间的旧会话补上 SESSION_TTL
+    python -m app.services.session_report --json report.json
+"""
+import argparse
+import json
+from collections import defaultdict
+from pathlib import Path
+import redis
+from app.config import settings
+from app.services.redis_service import r
+
+SCAN_BATCH = 500
+TTL_BUCKETS = ((3600, "<=1h"), (24 * 3600, "<=1d"), (7 * 24 * 3600, "<=7d"))
+
+
+def _batches(kind: str):
+    """逐批产出会话 key：hash 为全部 hash（再由 _only_sessions 过滤），symptoms 为以 :symptoms 结尾的 set"""
+    if kind == "hash":
+        keys = r.scan_iter(count=SCAN_BATCH, _type="hash")
+    else:
+        keys = r.scan_iter(match="*:symptoms", count=SCAN_BATCH, _type="set")
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= SCAN_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _only_sessions(keys: list) -> list:
+    """会话 hash 都有 turn 字段，知识表等其他 hash 不计入"""
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.hexists(key, "turn")
+    return [key for key, is_session in zip(keys, pipe.execute()) if is_session]
+
+
+def _session_batches():
+    for kind in ("hash", "symptoms"):
+        for keys in _batches(kind):
+            if kind == "hash":
+                keys = _only_sessions(keys)
+            if keys:
+                yield kind, keys
+
+
+def _memory(keys: list) -> list[int]:
+    """每个 key 的内存占用（MEMORY USAGE）；服务端禁用该命令时退而用 DUMP 序列化长度近似"""
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.memory_usage(key)
+    try:
+        return [n or 0 for n in pipe.execute()]
+    except redis.ResponseError:
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.dump(key)
+        return [len(payload or b"") for payload in pipe.execute()]
+
+
+def _ttl_bucket(ttl: int) -> str:
+    if ttl < 0:
+        return "no_expiry"
+    for limit, name in TTL_BUCKETS:
+        if ttl <= limit:
+            return name
+    return ">7d"
+
+
+def report(sample: int, expire_legacy: bool) -> dict:
+    result = {kind: {"keys": 0, "bytes": 0, "ttl": defaultdict(int)} for kind in ("hash", "symptoms")}
+    field_bytes, sampled, expired = defaultdict(int), 0, 0
+    for kind, keys in _session_batches():
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+        ttls = pipe.execute()
+        stats = result[kind]
+        stats["keys"] += len(keys)
+        stats["bytes"] += sum(_memory(keys))
+        for ttl in ttls:
+            stats["ttl"][_ttl_bucket(ttl)] += 1
+
+        legacy = [key for key, ttl in zip(keys, ttls) if ttl == -1]
+        if expire_legacy and legacy and settings.session_ttl > 0:
+            pipe = r.pipeline(transaction=False)
+            for key in legacy:
+                pipe.expire(key, settings.session_ttl)
+            expired += sum(pipe.execute())
+
+        # 抽样统计会话 hash 各字段的平均字节数，找出占内存的字段
+        if kind == "hash" and sampled < sample:
+            pipe = r.pipeline(transaction=False)
+            for key in keys[:sample - sampled]:
+                pipe.hgetall(key)
+            for data in pipe.execute():
+                for field, value in data.items():
+                    field_bytes[field] += len(field.encode("utf-8")) + len(value.encode("utf-8"))
+                sampled += 1
+
+    for stats in result.values():
+        stats["ttl"] = dict(stats["ttl"])
+        stats["mean_bytes"] = round(stats["bytes"] / stats["keys"], 1) if stats["keys"] else None
+    result["sessions"] = result["hash"]["keys"]
+    result["total_bytes"] = result["hash"]["bytes"] + result["symptoms"]["bytes"]
+    result["field_mean_bytes"] = {
+        field: round(n / sampled, 1) for field, n in sorted(field_bytes.items(), key=lambda kv: -kv[1])
+    } if sampled else {}
+    if expire_legacy:
+        result["legacy_keys_expired"] = expired
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sample", type=int, default=1000, help="统计字段大小时抽样的会话数")
+    parser.add_argument("--expire-legacy", action="store_true", help="给没有过期时间的会话 key 设置 SESSION_TTL")
+    parser.add_argument("--json", help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    result = report(args.sample, args.expire_legacy)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
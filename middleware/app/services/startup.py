@@ -0,0 +1,114 @@
+# app/services/startup.py
+# 启动编排：并发加载编码器、向量存储与疾病知识快照，记录各阶段耗时，供 /ready 报告就绪状态。
+# 启动时依赖短暂不可用（Redis / Neo4j 未就绪、编码 sidecar 尚未监听）时，失败的阶段按指数退避重试
+# STARTUP_RETRIES 次；仍失败则记为 failed，/health 随之返回 503，由编排系统重启 worker。
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.services import encoder, semantic, disease_snapshot, symptom_ids
+from app.services.neo4j_service import preload_diseases_with_symptoms
+
+logger = logging.getLogger(__name__)
+
+RETRY_BACKOFF = (1.0, 30.0)  # 失败阶段重试的初始 / 最大间隔（秒）
+
+
+def _load_disease_snapshot():
+    preload_diseases_with_symptoms()
+    snapshot = disease_snapshot.load()
+    disease_snapshot.start_listener()  # 订阅知识表更新，热切换内存快照
+    logger.info(f"疾病知识快照已加载：{len(snapshot.diseases)} 个疾病，代号 {snapshot.generation}，版本 {snapshot.version}")
+
+
+def _load_vector_store():
+    store = semantic.load()
+    symptom_ids.load(store.ids, store.names)  # 症状 ID 由 featureID 得出，请求路径上的编码只查进程内字典
+
+
+# 各阶段互不依赖，并发执行；编码器阶段包含一次预热前向
+PHASES = {
+    "encoder": encoder.warmup,
+    "vector_store": _load_vector_store,
+    "disease_snapshot": _load_disease_snapshot,
+}
+
+_lock = threading.Lock()
+_phases = {name: {"status": "pending", "seconds": None, "error": None, "attempts": 0} for name in PHASES}
+_started_at = None
+_finished_at = None
+_error = None  # run() 本身抛出的异常（各阶段之外的编排错误），见 on_done
+
+
+def _run_phase(name: str):
+    with _lock:
+        _phases[name]["status"] = "running"
+    t0 = time.perf_counter()
+    delay = RETRY_BACKOFF[0]
+    for attempt in range(1, settings.startup_retries + 2):
+        try:
+            PHASES[name]()
+            status, error = "ok", None
+            break
+        except Exception as e:
+            status, error = "failed", f"{type(e).__name__}: {e}"
+            if attempt > settings.startup_retries:
+                logger.exception(f"启动阶段 {name} 失败，已重试 {settings.startup_retries} 次")
+                break
+            logger.warning(f"启动阶段 {name} 第 {attempt} 次失败（{error}），{delay:.0f}s 后重试")
+            with _lock:
+                _phases[name].update(status="retrying", error=error)
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_BACKOFF[1])
+    seconds = round(time.perf_counter() - t0, 3)
+    with _lock:
+        _phases[name].update(status=status, seconds=seconds, error=error, attempts=attempt)
+    logger.info(f"启动阶段 {name}：{status}，耗时 {seconds}s")
+
+
+def run():
+    """执行全部启动阶段（阻塞直到完成，含失败重试），任一阶段最终失败则保持未就绪"""
+    global _started_at, _finished_at
+    _started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(PHASES), thread_name_prefix="startup") as pool:
+        list(pool.map(_run_phase, PHASES))
+    _finished_at = time.perf_counter()
+    logger.info(f"启动完成，总耗时 {_finished_at - _started_at:.3f}s，就绪：{is_ready()}")
+
+
+def on_done(future):
+    """后台执行 run() 的 future 的完成回调：异常逃出 run() 时记录日志并标记启动失败，而不是被悄悄丢弃"""
+    global _error
+    if future.cancelled():
+        error = "CancelledError: 启动被取消"
+        logger.error("启动编排被取消")
+    else:
+        e = future.exception()
+        if e is None:
+            return
+        logger.error("启动编排异常退出", exc_info=(type(e), e, e.__traceback__))
+        error = f"{type(e).__name__}: {e}"
+    with _lock:
+        _error = error
+
+
+def is_ready() -> bool:
+    with _lock:
+        return _error is None and all(phase["status"] == "ok" for phase in _phases.values())
+
+
+def has_failed() -> bool:
+    """是否有阶段在重试用尽后仍失败，或启动编排本身异常退出（此时 worker 不会再自行就绪）"""
+    with _lock:
+        return _error is not None or any(phase["status"] == "failed" for phase in _phases.values())
+
+
+def status() -> dict:
+    with _lock:
+        phases = {name: dict(phase) for name, phase in _phases.items()}
+        error = _error
+    total = None
+    if _started_at is not None:
+        total = round((_finished_at or time.perf_counter()) - _started_at, 3)
+    return {"ready": is_ready(), "total_seconds": total, "error": error, "phases": phases}
@@ -0,0 +1,82 @@
+# app/services/symptom_ids.py
+# 症状名 <-> 整数 ID 的映射，用于压缩会话中的症状字段：
+# 会话症状 set 的成员全是整数时 Redis 以 intset 存储，每个症状只占几个字节，而不是重复保存十几字节的中文名。
+# ID 由向量存储表中的 featureID 确定性地得出（feature_b08b3b7e -> 0xb08b3b7e），不依赖 Redis 中的任何可变状态：
+# 各 worker、各次重启、向量存储重建前后都一致，Redis 数据丢失或被淘汰也不会让已存的会话解码成别的症状。
+# 映射只在进程内，编码 / 解码不访问 Redis（异步接口在事件循环上调用也不会阻塞）。
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_tables = None  # (症状名 -> ID, ID -> 症状名)，向量存储加载后建立
+_unknown = set()  # 已记录过日志的未知 ID，同一个 ID 只警告一次
+
+
+def feature_int(feature_id: str) -> int:
+    """featureID -> 整数 ID：取最后一个下划线之后的十六进制部分；不是这种格式时取 sha1 前 15 位（仍在 int64 范围内）"""
+    suffix = feature_id.rpartition("_")[2]
+    if 0 < len(suffix) <= 15:
+        try:
+            return int(suffix, 16)
+        except ValueError:
+            pass
+    return int(hashlib.sha1(feature_id.encode("utf-8")).hexdigest()[:15], 16)
+
+
+def load(feature_ids: list[str], names: list[str]):
+    """由向量存储的 (featureID, 症状名) 表建立映射（启动时加载向量存储后调用）"""
+    global _tables
+    ids, by_id = {}, {}
+    for feature_id, name in zip(feature_ids, names):
+        value = feature_int(feature_id)
+        if by_id.get(value, name) != name:
+            raise ValueError(f"featureID {feature_id} 的整数 ID {value} 与症状“{by_id[value]}”冲突")
+        ids.setdefault(name, value)
+        by_id[value] = name
+    with _lock:
+        _tables = (ids, by_id)
+
+
+def _get_tables() -> tuple[dict, dict]:
+    if _tables is None:
+        from app.services import semantic  # 延迟导入：semantic 经 norm_cache 依赖 redis_service
+        store = semantic.STORE or semantic.load()
+        with _lock:
+            loaded = _tables is not None
+        if not loaded:
+            load(store.ids, store.names)
+    return _tables
+
+
+def encode(names) -> list:
+    """症状名 -> ID；不在向量存储表中的症状名原样保留（decode 时按症状名处理）"""
+    ids = _get_tables()[0]
+    return [ids.get(name, name) for name in names]
+
+
+def decode(values) -> list[str]:
+    """
+    ID（整数或数字字符串）-> 症状名；其他字符串视为改用 ID 编码之前写入的症状名，原样返回。
+    向量存储中已删除的特征的 ID 无法还原为症状名，直接丢弃（记录日志），不把数字串当作症状返回给调用方。
+    """
+    by_id = _get_tables()[1]
+    names = []
+    for v in values:
+        if not (isinstance(v, int) or (v.isascii() and v.isdigit())):
+            names.append(v)
+        elif (name := by_id.get(int(v))) is not None:
+            names.append(name)
+        else:
+            _drop_unknown(int(v))
+    return names
+
+
+def _drop_unknown(value: int):
+    with _lock:
+        if value in _unknown:
+            return
+        _unknown.add(value)
+    logger.warning(f"症状 ID {value} 不在当前向量存储中（对应特征可能已被删除），已从会话症状中忽略")
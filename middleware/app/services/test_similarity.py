@@ -1,17 +1,15 @@
-import pickle
 import numpy as np
 from sentence_transformers import SentenceTransformer
+from vector_store import load_store
 
-VEC_PATH = "feature_vec.pkl"
-MODEL_NAME = "moka-ai/m3e-small"   # 如果需要二次编码
+HEADER_PATH = "feature_vec.header.json"
 
 # 加载
-with open(VEC_PATH, "rb") as f:
-    data = pickle.load(f)
-ids, names, vecs = data["ids"], data["names"], data["vecs"]
+store = load_store(HEADER_PATH)
+ids, names, vecs = store.ids, store.names, store.float_vecs()
 
 # 加载模型（仅用于在线编码新输入）
-model = SentenceTransformer(MODEL_NAME)
+model = SentenceTransformer(store.model)
 
 # 测试一条
 raw = "鸡冠肿胀"
@@ -0,0 +1,67 @@
+# app/services/vector_index.py
+import numpy as np
+
+
+class ExactIndex:
+    """
+    精确检索：与知识库全部向量做内积，取 top-k（向量均已归一化，内积即余弦相似度）。
+    vecs 可以是 float16 / int8 的 memmap，按块反量化计算，不在进程内常驻 float32 副本。
+    """
+
+    CHUNK_ROWS = 8192
+
+    def __init__(self, vecs: np.ndarray, scale: float = 1.0):
+        self.vecs = vecs
+        self.scale = scale
+
+    def _sims(self, queries: np.ndarray) -> np.ndarray:
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.vecs.dtype == np.float32:
+            return np.dot(queries, self.vecs.T)
+        sims = np.empty((len(queries), len(self.vecs)), dtype=np.float32)
+        for start in range(0, len(self.vecs), self.CHUNK_ROWS):
+            chunk = self.vecs[start:start + self.CHUNK_ROWS].astype(np.float32)
+            sims[:, start:start + len(chunk)] = np.dot(queries, chunk.T)
+        if self.scale != 1.0:
+            sims *= np.float32(self.scale)
+        return sims
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """返回 (scores, idxs)，形状均为 查询数 × k，按相似度从高到低排列"""
+        sims = self._sims(queries)
+        k = min(k, sims.shape[1])
+        idxs = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(sims, idxs, axis=1)
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(idxs, order, axis=1)
+
+
+class HNSWIndex:
+    """近似检索：基于 hnswlib 的 HNSW 图索引，适用于数万以上的症状词表"""
+
+    def __init__(self, vecs: np.ndarray, m: int = 16, ef_construction: int = 200, ef: int = 64):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise RuntimeError("HNSW 向量索引需要安装 hnswlib：pip install hnswlib") from e
+        self.size = len(vecs)
+        self.index = hnswlib.Index(space="ip", dim=vecs.shape[1])
+        self.index.init_index(max_elements=max(self.size, 1), M=m, ef_construction=ef_construction)
+        if self.size:
+            self.index.add_items(np.asarray(vecs, dtype=np.float32), np.arange(self.size))
+        self.index.set_ef(ef)
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        k = min(k, self.size)
+        labels, distances = self.index.knn_query(np.asarray(queries, dtype=np.float32), k=k)
+        # hnswlib 的 ip 距离为 1 - 内积
+        return 1.0 - distances, labels.astype(np.int64)
+
+
+def create_index(store, backend: str = "exact", **options):
+    """根据向量存储（见 vector_store.VectorStore）创建检索索引"""
+    if backend == "exact":
+        return ExactIndex(store.vecs, store.scale)
+    if backend == "hnsw":
+        return HNSWIndex(store.float_vecs(), **options)
+    raise ValueError(f"未知的向量索引类型: {backend}")
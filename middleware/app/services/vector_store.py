@@ -0,0 +1,180 @@
+"""
+症状向量存储：替代 feature_vec.pkl 的二进制格式，由三部分组成：
+
+    feature_vec.header.json          头信息：模型名、编码后端、维度、条数、数据类型、量化系数、校验和及数据文件名
+    feature_vec.<checksum>.npy       向量矩阵（float32 / float16 / int8），以 np.memmap 只读打开
+    feature_vec.<checksum>.table.json  ID / 名称表
+
+多个 uvicorn worker 以 memmap 方式打开同一个 .npy 文件，由操作系统共享同一份物理内存，
+启动时也不再需要反序列化。数据文件名带校验和，每个文件都先写临时文件再 os.replace 原子替换（头文件最后替换），
+已打开旧文件的进程不受影响——即使重新生成的数据文件与正在 memmap 的文件同名，也不会原地截断它。
+
+从旧的 pickle 格式转换（在 middleware 目录下）：
+    python -m app.services.vector_store convert app/services/feature_vec.pkl --dtype float16
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+from pathlib import Path
+
+FORMAT_VERSION = 1
+DTYPES = ("float32", "float16", "int8")
+HEADER_PATH = Path(__file__).with_name("feature_vec.header.json")
+
+
+class VectorStore:
+    def __init__(self, header: dict, ids: list, names: list, vecs: np.ndarray):
+        self.header = header
+        self.ids = ids
+        self.names = names
+        self.vecs = vecs  # 原始存储类型的只读 memmap，int8 需乘以 scale
+        self.model = header["model"]
+        self.backend = header.get("backend", "torch")  # 编码后端标识（见 onnx_encoder.backend_tag），旧文件均为 torch
+        self.dim = header["dim"]
+        self.scale = header["scale"]
+        self.checksum = header["checksum"]
+
+    def float_vecs(self) -> np.ndarray:
+        """float32 视图：float32 存储时直接返回 memmap（不复制），否则反量化出私有副本"""
+        if self.vecs.dtype == np.float32:
+            return self.vecs
+        return self.vecs.astype(np.float32) * np.float32(self.scale)
+
+
+CHECKSUM_CHUNK = 1 << 24  # 校验和分块大小（字节）：memmap 按块读入页缓存，不在每个 worker 中复制整个矩阵
+
+
+def _checksum(vecs: np.ndarray, table_bytes: bytes) -> str:
+    digest = hashlib.sha1()
+    digest.update(str(vecs.dtype).encode("utf-8"))
+    # 按行分块计算（结果与一次性对整个矩阵的字节取摘要相同），每次只有一块的私有副本
+    rows = max(1, CHECKSUM_CHUNK // max(vecs[:1].nbytes, 1))
+    for start in range(0, len(vecs), rows):
+        digest.update(np.ascontiguousarray(vecs[start:start + rows]).data)
+    digest.update(table_bytes)
+    return digest.hexdigest()
+
+
+def _quantize(vecs: np.ndarray, dtype: str, scale: float | None = None) -> tuple[np.ndarray, float]:
+    vecs = np.asarray(vecs, dtype=np.float32)
+    if dtype == "float32":
+        return vecs, 1.0
+    if dtype == "float16":
+        return vecs.astype(np.float16), 1.0
+    if dtype == "int8":
+        # 对称量化：向量已归一化，分量绝对值不超过 1；给定 scale 时沿用（增量重建，见 write_store）
+        if scale is None:
+            scale = float(np.abs(vecs).max() / 127) if vecs.size else 1.0
+        return np.clip(np.round(vecs / scale), -127, 127).astype(np.int8), scale
+    raise ValueError(f"不支持的向量数据类型: {dtype}，可选 {DTYPES}")
+
+
+def write_store(ids: list, names: list, vecs: np.ndarray, model: str,
+                header_path: Path = HEADER_PATH, dtype: str = "float32", backend: str = "torch",
+                scale: float | None = None) -> dict:
+    """
+    scale 只对 int8 有效：增量重建时传入现有存储的量化尺度，复用的向量（由原 int8 值反量化而来）
+    按同一尺度量化后与原值逐位相同，误差不会随重建次数累积；为 None 时按全部向量重新计算。
+    """
+    header_path = Path(header_path)
+    data, scale = _quantize(vecs, dtype, scale)
+    table_bytes = json.dumps({"ids": ids, "names": names}, ensure_ascii=False).encode("utf-8")
+    checksum = _checksum(data, table_bytes)
+
+    stem = header_path.name.removesuffix(".header.json")
+    vec_file = f"{stem}.{checksum[:12]}.npy"
+    table_file = f"{stem}.{checksum[:12]}.table.json"
+    header = {
+        "format": FORMAT_VERSION,
+        "model": model,
+        "backend": backend,
+        "dim": int(data.shape[1]) if data.ndim == 2 else 0,
+        "count": len(ids),
+        "dtype": dtype,
+        "scale": scale,
+        "checksum": checksum,
+        "vectors": vec_file,
+        "table": table_file,
+    }
+
+    # 先写数据文件，最后原子替换头文件
+    _replace(header_path.with_name(vec_file), lambda f: np.save(f, data))
+    _replace(header_path.with_name(table_file), lambda f: f.write(table_bytes))
+    _replace(header_path, lambda f: f.write(json.dumps(header, ensure_ascii=False, indent=2).encode("utf-8")))
+    _cleanup(header_path, keep={vec_file, table_file})
+    return header
+
+
+def _replace(path: Path, write):
+    """写入同目录下的临时文件后 os.replace：已 memmap 旧文件的进程继续读旧 inode，不会因截断收到 SIGBUS"""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _cleanup(header_path: Path, keep: set):
+    """删除旧版本的数据文件（已 memmap 打开的进程仍可继续读取）"""
+    stem = header_path.name.removesuffix(".header.json")
+    for path in header_path.parent.glob(f"{stem}.*"):
+        if path.name in keep or path == header_path:
+            continue
+        if path.name.endswith(".npy") or path.name.endswith(".table.json"):
+            path.unlink(missing_ok=True)
+
+
+def read_header(header_path: Path = HEADER_PATH) -> dict:
+    """只读取头信息（模型名等），不映射向量文件"""
+    header = json.loads(Path(header_path).read_text(encoding="utf-8"))
+    if header.get("format") != FORMAT_VERSION:
+        raise ValueError(f"不支持的向量存储格式版本: {header.get('format')}")
+    return header
+
+def load_store(header_path: Path = HEADER_PATH, verify: bool = True) -> VectorStore:
+    header_path = Path(header_path)
+    header = read_header(header_path)
+    table_bytes = header_path.with_name(header["table"]).read_bytes()
+    table = json.loads(table_bytes)
+    vecs = np.load(header_path.with_name(header["vectors"]), mmap_mode="r")
+    if vecs.shape != (header["count"], header["dim"]):
+        raise ValueError(f"向量形状 {vecs.shape} 与头信息不符")
+    if verify and _checksum(vecs, table_bytes) != header["checksum"]:
+        raise ValueError(f"向量存储校验失败: {header_path}")
+    return VectorStore(header, table["ids"], table["names"], vecs)
+
+
+def convert_pickle(pkl_path: Path, header_path: Path = HEADER_PATH, dtype: str = "float32",
+                   model: str = "moka-ai/m3e-small") -> dict:
+    with open(pkl_path, "rb") as f:
+        data = pickle.load(f)
+    return write_store(data["ids"], data["names"], np.asarray(data["vecs"]), model, header_path, dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    conv = sub.add_parser("convert", help="把 feature_vec.pkl 转换为新的向量存储")
+    conv.add_argument("pkl")
+    conv.add_argument("--out", default=str(HEADER_PATH), help="头文件路径")
+    conv.add_argument("--dtype", choices=DTYPES, default="float32")
+    conv.add_argument("--model", default="moka-ai/m3e-small")
+    info = sub.add_parser("info", help="查看并校验向量存储")
+    info.add_argument("header", nargs="?", default=str(HEADER_PATH))
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        header = convert_pickle(Path(args.pkl), Path(args.out), args.dtype, args.model)
+        print(f"已转换 {header['count']} 个向量（{header['dtype']}）到 {args.out}")
+    else:
+        store = load_store(Path(args.header))
+        print(json.dumps(store.header, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# tests/conftest.py
+# 与离线基准（bench_diagnosis._install_backends）相同：在导入 app 模块前把 Redis 换成 fakeredis（需 pip install fakeredis lupa，
+# Lua 脚本由 lupa 执行），所有同步 / 异步客户端共用同一个内存 server。未安装时依赖 Redis 的测试跳过，其余照常运行。
+import asyncio
+import os
+import pytest
+
+for _key, _value in (("NEO4J_URI", "bolt://localhost:7687"), ("NEO4J_USER", "neo4j"),
+                     ("NEO4J_PASSWORD", "test"), ("REDIS_URL", "redis://localhost:6379/0")):
+    os.environ.setdefault(_key, _value)
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  fakeredis 执行 EVAL / EVALSHA 需要 lupa
+except ImportError:
+    fakeredis = None
+else:
+    import redis
+    import redis.asyncio
+    _server = fakeredis.FakeServer()
+    redis.from_url = lambda url, **kw: fakeredis.FakeRedis(server=_server, **kw)
+    redis.asyncio.from_url = lambda url, **kw: fakeredis.FakeAsyncRedis(server=_server, **kw)
+
+# 测试用的症状表：(featureID, 症状名)，症状 ID 即 featureID 的十六进制后缀
+FEATURES = [("feature_0000000a", "咳嗽"), ("feature_0000000b", "发热"), ("feature_0000000c", "腹泻"),
+            ("feature_0000000d", "精神沉郁")]
+
+
+@pytest.fixture
+def fake_redis():
+    """清空的 fakeredis（同步客户端），并以 FEATURES 建立症状 ID 映射"""
+    if fakeredis is None:
+        pytest.skip("需要安装 fakeredis 与 lupa：pip install fakeredis lupa")
+    from app.services import redis_service, symptom_ids
+    symptom_ids.load([feature_id for feature_id, _ in FEATURES], [name for _, name in FEATURES])
+    redis_service.r.flushall()
+    yield redis_service.r
+    redis_service.r.flushall()
+
+
+@pytest.fixture(scope="session")
+def run_async():
+    """在同一个事件循环上运行协程：异步 Redis 客户端的连接绑定在创建它的事件循环上，不能每次 asyncio.run 换新循环"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
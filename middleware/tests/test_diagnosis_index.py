@@ -0,0 +1,114 @@
+# tests/test_diagnosis_index.py
+# DiagnosisIndex 的等价性检查：MaxScore top_k、增量 apply_delta、批量 score_batch 都必须与全量暴力打分一致，
+# get_scores 与 rank_bm25.BM25Okapi 一致（未安装 rank_bm25 时跳过该项）。
+# 运行（在 middleware 目录下）：python -m pytest -q
+import numpy as np
+import pytest
+from app.services.diagnosis_index import DiagnosisIndex, pack_scores, unpack_scores
+from app.services.kg_csv import KG_DIR, load_kg
+
+QUERIES = 2000
+
+
+def _random_table(rng, diseases: int, features: int) -> dict:
+    # Zipf 分布的症状：少数常见症状出现在大量疾病中（长倒排表），多数症状只属于个别疾病；同一疾病可能重复列出同一症状
+    return {
+        f"d{i}": {"symptoms": [f"f{x}" for x in rng.zipf(1.3, rng.integers(5, 40)) % features]}
+        for i in range(diseases)
+    }
+
+
+def _random_query(rng, features: int) -> list[str]:
+    return [f"f{x}" for x in rng.zipf(1.3, rng.integers(1, 8)) % features]
+
+
+def _kg_table() -> dict:
+    table = load_kg(KG_DIR)
+    return {
+        disease_id: {"symptoms": record["symptoms"], "group_types": dict(zip(record["symptoms"], record["group_types"]))}
+        for disease_id, record in table.items()
+    }
+
+
+@pytest.fixture(scope="module")
+def random_index():
+    rng = np.random.default_rng(0)
+    table = _random_table(rng, 300, 2000)
+    return table, DiagnosisIndex(table)
+
+
+@pytest.fixture(scope="module")
+def kg_index():
+    if not (KG_DIR / "relation.csv").exists():
+        pytest.skip(f"知识图谱导入数据不存在：{KG_DIR}")
+    table = _kg_table()
+    return table, DiagnosisIndex(table)
+
+
+def _brute_force_top_k(scores: np.ndarray, k: int, threshold: float) -> list[int]:
+    """得分降序、同分按行号升序，只保留得分为正且不低于 threshold 的疾病"""
+    order = np.lexsort((np.arange(len(scores)), -scores))
+    return [row for row in order if scores[row] > 0 and scores[row] >= threshold][:k]
+
+
+@pytest.mark.parametrize("k", [1, 3, 5])
+@pytest.mark.parametrize("threshold", [0.0, 0.7])
+def test_top_k_matches_brute_force(random_index, k, threshold):
+    _, index = random_index
+    rng = np.random.default_rng(k)
+    for _ in range(QUERIES):
+        query = _random_query(rng, 2000)
+        scores = index.get_scores(query)
+        rows, values = index.top_k(query, k, threshold)
+        expected = _brute_force_top_k(scores, k, threshold)
+        # 浮点累加顺序不同，同分疾病在第 k 名边界上可能换位：行号不同时得分必须一致
+        if list(rows) != expected:
+            assert len(rows) == len(expected), query
+            np.testing.assert_allclose(scores[list(rows)], scores[expected], err_msg=str(query))
+        np.testing.assert_allclose(values, scores[list(rows)])
+
+
+def test_top_k_on_knowledge_graph(kg_index):
+    _, index = kg_index
+    rng = np.random.default_rng(1)
+    for _ in range(QUERIES):
+        query = list(rng.choice(index.terms, size=rng.integers(1, 8)))
+        scores = index.get_scores(query)
+        for k in (1, 3, 5):
+            rows, _ = index.top_k(query, k)
+            np.testing.assert_allclose(scores[list(rows)], scores[_brute_force_top_k(scores, k, 0.0)])
+
+
+def test_score_batch_matches_get_scores(random_index):
+    _, index = random_index
+    rng = np.random.default_rng(2)
+    queries = [_random_query(rng, 2000) for _ in range(200)]
+    batch = index.score_batch(queries)
+    for query, row in zip(queries, batch):
+        np.testing.assert_allclose(row, index.get_scores(query))
+
+
+def test_apply_delta_matches_full_rescore(random_index):
+    """模拟多轮会话：每轮新增 / 撤回若干症状，增量得分（经会话中的打包格式往返）与对当前症状集合全量打分一致"""
+    _, index = random_index
+    rng = np.random.default_rng(3)
+    for _ in range(200):
+        symptoms, scores = set(), np.zeros(len(index.disease_ids))
+        for _ in range(int(rng.integers(1, 10))):
+            added = [term for term in dict.fromkeys(_random_query(rng, 2000)) if term not in symptoms]
+            removed = [term for term in symptoms if rng.random() < 0.3]
+            symptoms = (symptoms | set(added)) - set(removed)
+            scores = unpack_scores(pack_scores(index.apply_delta(scores, added, removed)), len(index.disease_ids))
+            # 打包为 float32，逐轮累积的舍入误差远小于诊断阈值
+            np.testing.assert_allclose(scores, index.get_scores(sorted(symptoms)), atol=1e-4)
+
+
+def test_get_scores_matches_rank_bm25(random_index, kg_index):
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    rng = np.random.default_rng(4)
+    for table, index in (random_index, kg_index):
+        bm25 = rank_bm25.BM25Okapi([record["symptoms"] for record in table.values()])
+        terms = index.terms
+        for _ in range(QUERIES // 10):
+            query = list(rng.choice(terms, size=rng.integers(1, 8)))
+            np.testing.assert_allclose(index.get_scores(query), bm25.get_scores(query))
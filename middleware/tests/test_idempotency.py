@@ -0,0 +1,103 @@
+# tests/test_idempotency.py
+# 诊断请求的幂等去重：窗口内的重复请求返回缓存的响应，进行中的重复请求合并到同一次计算，
+# 其他 worker 的占位未写回时等待超时抛出 RequestInFlight，计算失败时释放占位让重试重新计算。
+import asyncio
+import threading
+import pytest
+from app.config import settings
+from app.models.chat import ChatRequest, ChatResponse
+from app.services import idempotency
+
+
+def _request(**kwargs) -> ChatRequest:
+    return ChatRequest(**{"user_id": "u", "session_id": "s", "query": "鸡咳嗽", "intent": "diagnose",
+                          "entities": ["咳嗽"], **kwargs})
+
+
+class Compute:
+    """记录调用次数的诊断替身；started / release 用于让重复请求在计算进行中到达"""
+
+    def __init__(self, block: bool = False):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self, req: ChatRequest) -> ChatResponse:
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        return ChatResponse(reply=f"第 {self.calls} 次计算", session_state={"turn": self.calls})
+
+
+def test_duplicate_served_from_cache(fake_redis):
+    compute = Compute()
+    first = idempotency.run(_request(), compute)
+    second = idempotency.run(_request(), compute)
+    assert compute.calls == 1
+    assert second == first
+    assert 0 < fake_redis.ttl(idempotency.request_key(_request())) <= settings.idempotency_ttl
+
+    # 内容不同的请求、或带不同请求 ID 的重发，都不算重复
+    idempotency.run(_request(entities=["发热"]), compute)
+    idempotency.run(_request(request_id="a"), compute)
+    idempotency.run(_request(request_id="b"), compute)
+    assert compute.calls == 4
+    assert idempotency.run(_request(request_id="a", query="改写过的问题"), compute).reply == "第 3 次计算"
+
+
+def test_concurrent_duplicate_coalesced(fake_redis):
+    compute = Compute(block=True)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(idempotency.run(_request(), compute))) for _ in range(3)]
+    threads[0].start()
+    assert compute.started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    compute.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert compute.calls == 1
+    assert len(results) == 3 and all(result == results[0] for result in results)
+
+
+def test_concurrent_duplicate_coalesced_async(fake_redis, run_async):
+    calls = 0
+
+    async def compute(req):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return ChatResponse(reply="异步计算", session_state={})
+
+    async def main():
+        return await asyncio.gather(*(idempotency.run_async(_request(), compute) for _ in range(3)))
+
+    results = run_async(main())
+    assert calls == 1
+    assert all(result == results[0] for result in results)
+    assert run_async(idempotency.run_async(_request(), compute)) == results[0]  # 之后的重试取缓存
+    assert calls == 1
+
+
+def test_pending_claim_times_out(fake_redis, monkeypatch):
+    # 其他 worker 已占位且迟迟未写回：等待超时后返回 503 由上游重试，而不是再算一遍
+    monkeypatch.setattr(settings, "idempotency_wait", 0.1)
+    fake_redis.set(idempotency.request_key(_request()), f"{idempotency.PENDING}other-worker")
+    compute = Compute()
+    with pytest.raises(idempotency.RequestInFlight):
+        idempotency.run(_request(), compute)
+    assert compute.calls == 0
+
+
+def test_failed_compute_releases_claim(fake_redis):
+    def fail(req):
+        raise RuntimeError("诊断失败")
+
+    with pytest.raises(RuntimeError):
+        idempotency.run(_request(), fail)
+    assert not fake_redis.exists(idempotency.request_key(_request()))
+    compute = Compute()
+    idempotency.run(_request(), compute)
+    assert compute.calls == 1
@@ -0,0 +1,84 @@
+# tests/test_question_selector.py
+# 追问症状选择：信息增益最高的是把候选疾病概率一分为二的症状；鉴别性症状优先、同组共有症状降权；
+# 已有或已问过的症状绝不再追问。
+import numpy as np
+import pytest
+from app.services import question_selector
+from app.services.diagnosis_index import DiagnosisIndex
+from app.services.kg_csv import KG_DIR, load_kg
+
+
+def _index(table: dict) -> DiagnosisIndex:
+    return DiagnosisIndex({
+        disease_id: {"symptoms": [name for name, _ in symptoms], "group_types": dict(symptoms)}
+        for disease_id, symptoms in table.items()
+    })
+
+
+@pytest.fixture(scope="module")
+def toy_index():
+    # half：A、B 有，C、D 没有；common：全部都有；rare：只有 A 有
+    return _index({
+        "A": [("half", None), ("common", None), ("rare", None)],
+        "B": [("half", None), ("common", None)],
+        "C": [("common", None), ("other", None)],
+        "D": [("common", None), ("other", None)],
+    })
+
+
+def test_highest_gain_splits_posterior(toy_index):
+    scores = np.zeros(len(toy_index.disease_ids))  # 均匀分布
+    gain, _, _ = question_selector.information_gain(toy_index, scores)
+    by_term = dict(zip(toy_index.terms, gain))
+    assert by_term["half"] == pytest.approx(1.0)
+    assert by_term["common"] == pytest.approx(0.0, abs=1e-9)  # 所有候选都有，回答不带来任何信息
+    assert by_term["half"] > by_term["rare"] > 0
+    assert question_selector.select(toy_index, scores, set(), 1) in (["half"], ["other"])
+
+
+def test_gain_follows_posterior(toy_index):
+    # 概率集中在 A、B 时，half 已不能区分它们，rare 才能
+    scores = np.array([5.0, 5.0, 0.0, 0.0])
+    assert question_selector.select(toy_index, scores, set(), 1) == ["rare"]
+
+
+def test_excluded_symptoms_never_suggested(toy_index):
+    scores = np.zeros(len(toy_index.disease_ids))
+    chosen = question_selector.select(toy_index, scores, {"half", "other"}, 5)
+    assert chosen and not {"half", "other"} & set(chosen)
+
+
+def test_different_preferred_over_similar():
+    # 两个症状对候选疾病的划分完全相同，只有 groupType 不同
+    index = _index({
+        "A": [("x", "different"), ("y", "similar")],
+        "B": [("x", "different"), ("y", "similar")],
+        "C": [("z", None)],
+        "D": [("z", None)],
+    })
+    scores = np.zeros(len(index.disease_ids))
+    assert question_selector.select(index, scores, {"z"}, 2) == ["x", "y"]
+
+
+def test_converged_candidates_skip_known_symptoms(toy_index):
+    # 只剩一个候选疾病时退而追问它尚未提及的症状，同样跳过已有 / 已问过的
+    scores = np.array([50.0, 0.0, 0.0, 0.0])
+    chosen = question_selector.select(toy_index, scores, {"half", "common"}, 5)
+    assert chosen == ["rare"]
+
+
+def test_exclusion_on_knowledge_graph():
+    if not (KG_DIR / "relation.csv").exists():
+        pytest.skip(f"知识图谱导入数据不存在：{KG_DIR}")
+    table = load_kg(KG_DIR)
+    index = DiagnosisIndex({
+        disease_id: {"symptoms": record["symptoms"], "group_types": dict(zip(record["symptoms"], record["group_types"]))}
+        for disease_id, record in table.items()
+    })
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        known = set(rng.choice(index.terms, size=rng.integers(1, 6)))
+        asked = set(rng.choice(index.terms, size=rng.integers(0, 10)))
+        chosen = question_selector.select(index, index.get_scores(sorted(known)), known | asked, 5)
+        assert len(chosen) == len(set(chosen))
+        assert not (known | asked) & set(chosen)
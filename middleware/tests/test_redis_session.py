@@ -0,0 +1,102 @@
+# tests/test_redis_session.py
+# 会话的两次往返：begin_turn（Lua：自增轮次、迁移旧版 entities 字段、SADD / SREM、刷新过期时间）
+# 与 commit_turn（pipeline 写回本轮字段，会话结束时缩短过期时间）；同步与异步实现共用同一个脚本，行为必须一致。
+import json
+import pytest
+from app.config import settings
+from app.services import redis_async, redis_service
+
+UID, SID = "u", "s"
+HASH, SYMPTOMS = f"{UID}:{SID}", f"{UID}:{SID}:symptoms"
+
+
+def _begin(mode, *args, **kwargs):
+    if mode is not None:
+        return mode(redis_async.begin_turn(UID, SID, *args, **kwargs))
+    return redis_service.begin_turn(UID, SID, *args, **kwargs)
+
+
+def _commit(mode, *args, **kwargs):
+    if mode is not None:
+        return mode(redis_async.commit_turn(UID, SID, *args, **kwargs))
+    return redis_service.commit_turn(UID, SID, *args, **kwargs)
+
+
+@pytest.fixture(params=["sync", "async"])
+def mode(request, fake_redis, run_async):
+    """同步实现时为 None，异步实现时为运行协程的函数"""
+    return run_async if request.param == "async" else None
+
+
+def test_first_turn_stores_symptom_ids(mode, fake_redis):
+    state, turn, added, removed = _begin(mode, ["咳嗽", "发热"])
+    assert (turn, added, removed) == (1, ["咳嗽", "发热"], [])
+    assert state["entities"] == sorted(["咳嗽", "发热"])
+    assert fake_redis.smembers(SYMPTOMS) == {str(0xa), str(0xb)}  # set 中存整数 ID，不存症状名
+    assert 0 < fake_redis.ttl(HASH) <= settings.session_ttl
+    assert 0 < fake_redis.ttl(SYMPTOMS) <= settings.session_ttl
+
+
+def test_repeated_symptom_not_added_again(mode, fake_redis):
+    _begin(mode, ["咳嗽"])
+    state, turn, added, _ = _begin(mode, ["咳嗽", "腹泻"])
+    assert (turn, added) == (2, ["腹泻"])
+    assert state["entities"] == sorted(["咳嗽", "腹泻"])
+
+
+def test_legacy_entities_field_migrated(mode, fake_redis):
+    # 改用 set 之前的会话：症状以 JSON 列表存在 hash 的 entities 字段中，且是症状名而不是 ID
+    fake_redis.hset(HASH, mapping={"turn": 3, "entities": json.dumps(["咳嗽", "发热"], ensure_ascii=False)})
+    state, turn, added, _ = _begin(mode, ["腹泻"])
+    assert (turn, added) == (4, ["腹泻"])
+    assert state["entities"] == sorted(["咳嗽", "发热", "腹泻"])
+    assert not fake_redis.hexists(HASH, "entities")
+    assert fake_redis.smembers(SYMPTOMS) == {"咳嗽", "发热", str(0xc)}
+
+    # 迁移后的旧症状名同样可以撤回
+    state, _, _, removed = _begin(mode, retracted=["咳嗽"])
+    assert removed == ["咳嗽"]
+    assert state["entities"] == sorted(["发热", "腹泻"])
+
+
+def test_retraction(mode, fake_redis):
+    _begin(mode, ["咳嗽", "发热", "腹泻"])
+    state, _, added, removed = _begin(mode, ["精神沉郁"], retracted=["咳嗽", "咳嗽", "没说过的症状"])
+    assert (added, removed) == (["精神沉郁"], ["咳嗽"])
+    assert state["entities"] == sorted(["发热", "腹泻", "精神沉郁"])
+
+    # 同一轮既新增又撤回的以新增为准
+    state, _, added, removed = _begin(mode, ["咳嗽"], retracted=["咳嗽", "发热"])
+    assert (added, removed) == (["咳嗽"], ["发热"])
+    assert state["entities"] == sorted(["咳嗽", "腹泻", "精神沉郁"])
+
+
+def test_commit_turn_writes_fields(mode, fake_redis):
+    state, _, _, _ = _begin(mode, ["咳嗽"])
+    ttl = fake_redis.ttl(HASH)
+    session = _commit(mode, state, asked=["发热", "腹泻"], pending=None, diagnosed=False, score_state="packed")
+    assert session["asked"] == ["发热", "腹泻"]
+    assert session["pending"] is None and session["diagnosed"] is False
+    assert "score_state" not in session  # 内部字段不返回给调用方
+    assert json.loads(fake_redis.hget(HASH, "asked")) == [0xb, 0xc]
+    assert fake_redis.hget(HASH, "score_state") == "packed"
+    assert fake_redis.ttl(HASH) == ttl  # 未结束的会话不改过期时间
+
+    # 下一轮读到的会话与写入的一致
+    state, turn, _, _ = _begin(mode)
+    assert turn == 2 and state["asked"] == ["发热", "腹泻"] and state["score_state"] == "packed"
+
+
+def test_finished_session_expires_sooner(mode, fake_redis):
+    state, _, _, _ = _begin(mode, ["咳嗽"])
+    _commit(mode, state, finished=True, diagnosed=True)
+    assert fake_redis.hget(HASH, "diagnosed") == "true"
+    assert 0 < fake_redis.ttl(HASH) <= settings.session_finished_ttl
+    assert 0 < fake_redis.ttl(SYMPTOMS) <= settings.session_finished_ttl
+
+
+def test_unknown_symptom_id_dropped(mode, fake_redis):
+    # 向量存储重建后已删除的特征：它的 ID 无法还原为症状名，不能以数字串出现在会话症状中
+    fake_redis.sadd(SYMPTOMS, str(0xa), str(0xfff))
+    state, _, _, _ = _begin(mode, ["发热"])
+    assert state["entities"] == sorted(["咳嗽", "发热"])